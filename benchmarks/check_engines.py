@@ -0,0 +1,110 @@
+import argparse
+import sys
+
+import numpy as np
+
+from data import make_adult_like
+from tabular_anonymizer.mondrian_anonymizer import MondrianAnonymizer
+from tabular_anonymizer.mondrian_engine import NumpyMondrianEngine
+from tabular_anonymizer.numba_kernels import numba, partition_compiled
+
+"""
+Checks that the numpy engine and its variants produce the same partitions as the pandas engine. Numeric
+quasi-identifiers get missing values and the sensitive column has more distinct values than most partitions have
+rows, so that splits leave rows out of both children and sensitive histograms are not kept. In the "correlated"
+data numeric columns are missing for whole categories of other columns, so that partitions have columns with no
+values at all (NaN spans).
+
+The numba variant runs the compiled kernel, or the same kernel as plain Python when Numba is not installed.
+The binned variant splits exactly because no numeric column has more distinct values than bins.
+
+    python benchmarks/check_engines.py --rows 2000 5000
+    python benchmarks/check_engines.py --rows 300 --seeds 40 --k 4
+"""
+
+DATA = ("independent", "correlated")
+VARIANTS = [
+    ("numpy", {}, {}),
+    ("numpy presort", {"presort": True}, {}),
+    ("numpy bins", {"bins": 255}, {}),
+    ("numpy n_jobs=2", {}, {"n_jobs": 2}),
+    ("numba", {}, {}),
+]
+FEATURE_COLUMNS = ["age", "sex", "education", "hours-per-week", "marital-status", "capital-gain"]
+
+
+def make_data(rows: int, missing: float, sensitive_values: int, seed: int, shape: str = "independent"):
+    # Uniform categories, so that every category is large enough to become a partition of its own
+    df = make_adult_like(rows, skew=0.0 if shape == "correlated" else 1.0, seed=seed)
+    rng = np.random.default_rng(seed)
+    # Gains in thousands, so that numeric columns have fewer distinct values than bins
+    df["capital-gain"] = df["capital-gain"] // 1000 * 1000
+    for column in ("age", "hours-per-week", "capital-gain"):
+        df[column] = df[column].astype(float)
+    if shape == "correlated":
+        # Missing for whole categories of other columns
+        df.loc[df["education"].isin(["Bachelors", "Some-college"]).to_numpy(), "age"] = np.nan
+        df.loc[(df["sex"] == "Female").to_numpy(), "hours-per-week"] = np.nan
+        df.loc[(df["marital-status"] == "Never-married").to_numpy(), "capital-gain"] = np.nan
+    else:
+        for column in ("age", "hours-per-week"):
+            df.loc[rng.random(rows) < missing, column] = np.nan
+    df["diagnosis"] = rng.integers(0, sensitive_values, rows)
+    return df
+
+
+def partition_kernel(df, feature_columns, k, l):
+    # Compiled kernel without the fallback to the numpy engine
+    mondrian = MondrianAnonymizer(df, feature_columns, ["diagnosis"], copy=False)
+    engine = NumpyMondrianEngine(mondrian.columns, feature_columns, ["diagnosis"], mondrian.max_split_count,
+                                 compiled=True)
+    return [df.index[rows] for rows in partition_compiled(engine, k, l)]
+
+
+def same_partitions(a: list, b: list) -> bool:
+    return sorted(tuple(sorted(p)) for p in a) == sorted(tuple(sorted(p)) for p in b)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare partitions of the numpy and pandas engines")
+    parser.add_argument("--rows", type=int, nargs="+", default=[2000])
+    parser.add_argument("--data", nargs="+", default=list(DATA), choices=DATA)
+    parser.add_argument("--seeds", type=int, default=1, help="number of data sets of each size")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--l", type=int, default=2)
+    parser.add_argument("--missing", type=float, default=0.1, help="share of missing numeric values")
+    parser.add_argument("--sensitive-values", type=int, default=200)
+    parser.add_argument("--variants", nargs="+", default=[v[0] for v in VARIANTS],
+                        choices=[v[0] for v in VARIANTS])
+    args = parser.parse_args()
+
+    if numba is None and "numba" in args.variants:
+        print("Numba is not installed, the numba kernel runs as plain Python", file=sys.stderr)
+    failed = False
+    for shape in args.data:
+        for rows in args.rows:
+            different = {name: 0 for name in args.variants}
+            for seed in range(args.seeds):
+                df = make_data(rows, args.missing, args.sensitive_values, seed, shape)
+                expected = MondrianAnonymizer(df, FEATURE_COLUMNS, ["diagnosis"],
+                                              engine="pandas").partition(args.k, args.l)
+                for name, options, partition_options in VARIANTS:
+                    if name not in args.variants:
+                        continue
+                    if name == "numba":
+                        partitions = partition_kernel(df, FEATURE_COLUMNS, args.k, args.l)
+                    else:
+                        mondrian = MondrianAnonymizer(df, FEATURE_COLUMNS, ["diagnosis"], **options)
+                        partitions = mondrian.partition(args.k, args.l, **partition_options)
+                    if not same_partitions(partitions, expected):
+                        different[name] += 1
+            for name, count in different.items():
+                failed = failed or count > 0
+                print("{shape:>12} {rows:>8} rows {name:>16}: {result}".format(
+                    shape=shape, rows=rows, name=name,
+                    result="ok" if count == 0 else "DIFFERENT in {c} of {n}".format(c=count, n=args.seeds)))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
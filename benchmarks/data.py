@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+"""
+Synthetic data with a schema like the adult census dataset. Categorical values are drawn from a Zipf-like
+distribution, skew 0 gives uniform categories and larger values make a few categories dominate.
+"""
+
+CATEGORIES = {
+    "workclass": ["Private", "Self-emp-not-inc", "Self-emp-inc", "Federal-gov", "Local-gov", "State-gov",
+                  "Without-pay", "Never-worked"],
+    "education": ["Bachelors", "Some-college", "11th", "HS-grad", "Prof-school", "Assoc-acdm", "Assoc-voc", "9th",
+                  "7th-8th", "12th", "Masters", "1st-4th", "10th", "Doctorate", "5th-6th", "Preschool"],
+    "marital-status": ["Married-civ-spouse", "Divorced", "Never-married", "Separated", "Widowed",
+                       "Married-spouse-absent", "Married-AF-spouse"],
+    "occupation": ["Tech-support", "Craft-repair", "Other-service", "Sales", "Exec-managerial", "Prof-specialty",
+                   "Handlers-cleaners", "Machine-op-inspct", "Adm-clerical", "Farming-fishing", "Transport-moving",
+                   "Priv-house-serv", "Protective-serv", "Armed-Forces"],
+    "relationship": ["Wife", "Own-child", "Husband", "Not-in-family", "Other-relative", "Unmarried"],
+    "race": ["White", "Asian-Pac-Islander", "Amer-Indian-Eskimo", "Other", "Black"],
+    "sex": ["Female", "Male"],
+}
+
+# Quasi-identifiers in the order they are taken with qi_count
+QI_COLUMNS = ["age", "sex", "education", "zip", "hours-per-week", "marital-status", "occupation", "race",
+              "capital-gain", "workclass", "relationship", "fnlwgt"]
+SENSITIVE_COLUMNS = ["label"]
+
+
+def zipf_choice(rng: np.random.Generator, values: list, n: int, skew: float) -> pd.Categorical:
+    p = 1.0 / np.arange(1, len(values) + 1) ** skew
+    codes = rng.choice(len(values), size=n, p=p / p.sum())
+    return pd.Categorical.from_codes(codes, categories=values)
+
+
+def make_adult_like(rows: int, skew: float = 1.0, zip_codes: int = 1000, seed: int = 0) -> DataFrame:
+    rng = np.random.default_rng(seed)
+    zips = ["{z:05d}".format(z=z) for z in rng.choice(100000, size=zip_codes, replace=False)]
+    df = DataFrame({
+        "age": rng.integers(17, 91, rows),
+        "workclass": zipf_choice(rng, CATEGORIES["workclass"], rows, skew),
+        "fnlwgt": rng.integers(10000, 1500000, rows),
+        "education": zipf_choice(rng, CATEGORIES["education"], rows, skew),
+        "marital-status": zipf_choice(rng, CATEGORIES["marital-status"], rows, skew),
+        "occupation": zipf_choice(rng, CATEGORIES["occupation"], rows, skew),
+        "relationship": zipf_choice(rng, CATEGORIES["relationship"], rows, skew),
+        "race": zipf_choice(rng, CATEGORIES["race"], rows, skew),
+        "sex": zipf_choice(rng, CATEGORIES["sex"], rows, 0.5),
+        "capital-gain": np.where(rng.random(rows) < 0.9, 0, rng.integers(100, 100000, rows)),
+        "hours-per-week": rng.integers(1, 100, rows),
+        "zip": zipf_choice(rng, zips, rows, skew),
+        "label": zipf_choice(rng, ["<=50K", ">50K"], rows, 1.5),
+    })
+    return df
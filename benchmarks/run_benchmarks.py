@@ -0,0 +1,157 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from data import QI_COLUMNS, SENSITIVE_COLUMNS, make_adult_like
+from tabular_anonymizer import DataFrameAnonymizer, utils
+from tabular_anonymizer.mondrian_anonymizer import MondrianAnonymizer
+
+"""
+Benchmarks for partitioning, building the anonymized dataframe, pseudonymization and partial masking.
+
+Every benchmark is timed repeat times and run once more under tracemalloc for peak memory. Results are written as
+JSON, and with --compare the timings are compared to an earlier result file.
+
+    python benchmarks/run_benchmarks.py --rows 10000 100000 1000000 --output results.json
+    python benchmarks/run_benchmarks.py --rows 10000 100000 --compare results.json
+"""
+
+BENCHMARKS = ("partition", "build", "pseudonymize", "partial_masking")
+
+
+def measure(function, repeat: int, memory: bool) -> (dict, object):
+    # Fastest of repeat timed runs, and peak traced memory of one more run
+    seconds = []
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    measurement = {"seconds": min(seconds), "all_seconds": seconds}
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        function()
+        measurement["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return measurement, result
+
+
+def run(rows: int, args) -> list:
+    df = make_adult_like(rows, skew=args.skew, seed=args.seed)
+    feature_columns = QI_COLUMNS[:args.qi_count]
+    results = []
+
+    def record(benchmark, measurement, **extra):
+        measurement.update({"benchmark": benchmark, "rows": rows})
+        measurement.update(extra)
+        results.append(measurement)
+        print("{benchmark:>16} {rows:>10} rows {seconds:9.3f} s".format(**measurement), flush=True)
+
+    def partition():
+        mondrian = MondrianAnonymizer(df, feature_columns, SENSITIVE_COLUMNS, engine=args.engine, copy=False)
+        return mondrian.partition(args.k, args.l)
+
+    partitions = None
+    if "partition" in args.benchmarks or "build" in args.benchmarks or "partial_masking" in args.benchmarks:
+        measurement, partitions = measure(partition, args.repeat if "partition" in args.benchmarks else 1,
+                                          args.memory and "partition" in args.benchmarks)
+        if "partition" in args.benchmarks:
+            record("partition", measurement, partitions=len(partitions))
+
+    anonymizer = DataFrameAnonymizer(SENSITIVE_COLUMNS, feature_columns)
+    anonymized = None
+    if "build" in args.benchmarks or "partial_masking" in args.benchmarks:
+        measurement, anonymized = measure(lambda: anonymizer.build_anonymized_dataframe(df, partitions),
+                                          args.repeat if "build" in args.benchmarks else 1,
+                                          args.memory and "build" in args.benchmarks)
+        if "build" in args.benchmarks:
+            record("build", measurement, output_rows=len(anonymized))
+
+    if "pseudonymize" in args.benchmarks:
+        # Pseudonymize a direct identifier, one distinct string per row
+        nonce1, nonce2 = "0123456789", "9876543210"
+        identifiers = pd.DataFrame({"id": df.index.astype(str)})
+        measurement, _ = measure(lambda: utils.pseudonymize(identifiers.copy(), "id", nonce1, nonce2),
+                                 args.repeat, args.memory)
+        record("pseudonymize", measurement)
+
+    if "partial_masking" in args.benchmarks:
+        if "zip" not in feature_columns:
+            print("partial_masking needs zip in the quasi-identifiers, increase --qi-count", file=sys.stderr)
+        else:
+            zips = anonymized[["zip"]]
+            measurement, _ = measure(lambda: utils.generalize(zips.copy(), "zip", utils.generalize_partial_masking),
+                                     args.repeat, args.memory)
+            record("partial_masking", measurement, output_rows=len(zips))
+    return results
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "commit": commit or None,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def compare(results: list, path: str) -> None:
+    # Ratio of new to old timing for benchmarks present in both result files
+    with open(path) as f:
+        previous = {(r["benchmark"], r["rows"]): r for r in json.load(f)["results"]}
+    print("\n{:>16} {:>10} {:>10} {:>10} {:>7}".format("benchmark", "rows", "old s", "new s", "ratio"))
+    for r in results:
+        old = previous.get((r["benchmark"], r["rows"]))
+        if old is not None:
+            print("{:>16} {:>10} {:10.3f} {:10.3f} {:7.2f}".format(r["benchmark"], r["rows"], old["seconds"],
+                                                                   r["seconds"], r["seconds"] / old["seconds"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for tabular_anonymizer")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--qi-count", type=int, default=6, help="number of quasi-identifiers, at most 12")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of categorical values, 0 is uniform")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--l", type=int, default=0)
+    parser.add_argument("--engine", default="numpy", choices=MondrianAnonymizer.ENGINES)
+    parser.add_argument("--benchmarks", nargs="+", default=list(BENCHMARKS), choices=BENCHMARKS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip tracemalloc runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="earlier result file to compare timings with")
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        results.extend(run(rows, args))
+    parameters = {name: value for name, value in vars(args).items() if name not in ("output", "compare")}
+    with open(args.output, "w") as f:
+        json.dump({"environment": environment(), "parameters": parameters, "results": results}, f, indent=2)
+    print("Results written to", args.output)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import matplotlib.pylab as pl
 import matplotlib.patches as patches
 import matplotlib.colors as mcolors
+from tabular_anonymizer import PartitionLabels
 
 
 def __build_indexes(df):
@@ -66,6 +67,8 @@ def __get_partition_rects(df, partitions, column_x, column_y, indexes, offsets=[
 
 
 def plot(df_orig, partitions, sensitive_columns, column_x=None, column_y=None):
+    if isinstance(partitions, PartitionLabels):
+        partitions = partitions.partitions(df_orig.index)
     indexes = __build_indexes(df_orig)
     df = df_orig.replace(indexes)
     all_columns = df.columns
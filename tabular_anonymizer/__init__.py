@@ -1,2 +1,7 @@
 from .dataframe_anonymizer import DataFrameAnonymizer
-from .utils import combine_and_pseudonymize, generalize_partial_masking, generalize
\ No newline at end of file
+from .incremental import IncrementalAnonymizer
+from .out_of_core import OutOfCoreAnonymizer
+from .partition_cache import PartitionCache
+from .partition_labels import PartitionLabels
+from .stats import AnonymizationStats
+from .utils import combine_and_pseudonymize, generalize_partial_masking, generalize
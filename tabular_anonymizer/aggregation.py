@@ -0,0 +1,248 @@
+from typing import List
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from pandas.api.types import is_categorical_dtype, is_extension_array_dtype, is_float_dtype, is_numeric_dtype
+
+from .partition_labels import PartitionLabels
+
+"""
+Anonymized dataframe built with grouped operations. Rows of all partitions are gathered once and labelled with their
+partition id. Minimum and maximum of numeric feature columns, distinct values of other feature columns, averages and
+counts of sensitive values are then computed for all partitions at once. The output is the same as aggregating every
+partition separately, including the iteration order of value sets and averages to the last bit.
+
+Outputs:
+    "lists"     [min, max] of numeric columns and a list of value strings of other columns, as Python lists
+    "strings"   (format_to_str) identical generalizations of different partitions are formatted only once. Values of
+                a set are sorted by their string form, and the columns are categorical with the distinct strings as
+                sorted categories.
+    "bounds"    numeric columns as <column>_min and <column>_max columns of the column's dtype
+    "intervals" numeric columns as closed intervals (pandas IntervalDtype)
+With "bounds" and "intervals", other columns are categorical with frozensets of values as categories, every distinct
+set is stored once.
+"""
+
+OUTPUTS = ("lists", "strings", "bounds", "intervals")
+
+
+def gather(df: DataFrame, partitions) -> (np.ndarray, np.ndarray, np.ndarray):
+    # Row positions of all partitions one after another, partition id of every position and start of every
+    # partition in positions. None if the index does not identify rows or partitions contain unknown labels.
+    if isinstance(partitions, PartitionLabels):
+        sizes = partitions.sizes()
+        positions = partitions.rows
+    else:
+        if not df.index.is_unique:
+            return None
+        sizes = np.fromiter((len(p) for p in partitions), dtype=np.int64, count=len(partitions))
+        if len(partitions) == 0:
+            return None
+        positions = df.index.get_indexer(np.concatenate([np.asarray(p) for p in partitions]))
+        if (positions < 0).any():
+            return None
+    if len(sizes) == 0 or sizes.min() == 0:
+        return None
+    pid = np.repeat(np.arange(len(partitions)), sizes)
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    return positions, pid, starts
+
+
+def min_max(series: pd.Series, positions: np.ndarray, pid: np.ndarray) -> (np.ndarray, np.ndarray):
+    # Arrays iterate as NumPy scalars (or NA), like Series.min() returns them
+    grouped = series.iloc[positions].reset_index(drop=True).groupby(pid, sort=False)
+    return grouped.min().array, grouped.max().array
+
+
+def value_sets(series: pd.Series, positions: np.ndarray, pid: np.ndarray, n_partitions: int) -> List[set]:
+    # Set of values of every partition. Values are added in order of first appearance, which gives the same
+    # iteration order as set() of all values of the partition.
+    codes, uniques = pd.factorize(series)
+    # 0 is missing value
+    key = pid * (len(uniques) + 1) + codes[positions] + 1
+    first = ~pd.Index(key).duplicated()
+    values = list(series.iloc[positions[first]])
+    counts = np.bincount(pid[first], minlength=n_partitions)
+    sets = []
+    start = 0
+    for count in counts:
+        sets.append(set(values[start:start + count]))
+        start += count
+    return sets
+
+
+def code_sets(series: pd.Series, positions: np.ndarray, pid: np.ndarray,
+              n_partitions: int) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+    # Distinct values of every partition as codes into the values of the column sorted by their string form (names).
+    # Codes of partition i are members[bounds[i]:bounds[i + 1]], in ascending order.
+    codes, uniques = pd.factorize(series)
+    # Missing values are the last value, the first missing value of the column (nan or None)
+    missing = np.flatnonzero(codes < 0)
+    values = np.empty(len(uniques) + 1, dtype=object)
+    values[:-1] = list(uniques)
+    values[-1] = series.iloc[missing[0]] if len(missing) else None
+    names = np.array([str(v) for v in values], dtype=object)
+    codes[missing] = len(uniques)
+    order = np.argsort(names, kind="stable")
+    rank = np.empty(len(names), dtype=np.int64)
+    rank[order] = np.arange(len(names))
+    key = np.unique(pid * len(names) + rank[codes[positions]])
+    members = key % len(names)
+    bounds = np.searchsorted(key // len(names), np.arange(n_partitions + 1))
+    return members, bounds, names[order], values[order]
+
+
+def distinct_sets(members: np.ndarray, bounds: np.ndarray) -> (np.ndarray, List[np.ndarray]):
+    # Id of the set of every partition, and codes of every distinct set, see code_sets()
+    ids = np.empty(len(bounds) - 1, dtype=np.int64)
+    seen = {}
+    sets = []
+    for i in range(len(ids)):
+        codes = members[bounds[i]:bounds[i + 1]]
+        key = codes.tobytes()
+        j = seen.get(key)
+        if j is None:
+            j = seen[key] = len(sets)
+            sets.append(codes)
+        ids[i] = j
+    return ids, sets
+
+
+def categorical_labels(ids: np.ndarray, labels: list) -> (np.ndarray, np.ndarray):
+    # Label ids as codes of sorted distinct labels
+    categories, inverse = np.unique(np.array(labels, dtype=object), return_inverse=True)
+    return inverse[ids], categories
+
+
+def interval_labels(minimum, maximum) -> (np.ndarray, np.ndarray):
+    # "min - max" of every partition as codes of categories, every distinct interval is formatted once
+    ids = DataFrame({"min": minimum, "max": maximum}).groupby(["min", "max"], sort=False, dropna=False).ngroup()
+    ids = ids.to_numpy()
+    first = np.unique(ids, return_index=True)[1]
+    labels = ["{min} - {max}".format(min=minimum[i], max=maximum[i]) for i in first]
+    return categorical_labels(ids, labels)
+
+
+def set_labels(series: pd.Series, positions: np.ndarray, pid: np.ndarray,
+               n_partitions: int) -> (np.ndarray, np.ndarray):
+    # Sorted values of every partition joined with ", ", as codes of categories. Every distinct set is formatted once.
+    members, bounds, names, _ = code_sets(series, positions, pid, n_partitions)
+    ids, sets = distinct_sets(members, bounds)
+    return categorical_labels(ids, [", ".join(names[codes]) for codes in sets])
+
+
+def value_set_categorical(series: pd.Series, positions: np.ndarray, pid: np.ndarray,
+                          n_partitions: int) -> pd.Categorical:
+    # Values of every partition as a categorical of frozensets, every distinct set is stored once
+    members, bounds, _, values = code_sets(series, positions, pid, n_partitions)
+    ids, sets = distinct_sets(members, bounds)
+    categories = np.empty(len(sets), dtype=object)
+    categories[:] = [frozenset(values[codes]) for codes in sets]
+    return pd.Categorical.from_codes(ids, categories)
+
+
+def interval_array(minimum, maximum) -> pd.arrays.IntervalArray:
+    # Intervals are built from NumPy arrays, integer bounds with missing values as float with NaN
+    dtype = minimum.dtype.numpy_dtype
+    if not is_float_dtype(dtype) and (minimum.isna().any() or maximum.isna().any()):
+        dtype = np.dtype(np.float64)
+    options = {"na_value": np.nan} if is_float_dtype(dtype) else {}
+    minimum = minimum.to_numpy(dtype=dtype, **options)
+    maximum = maximum.to_numpy(dtype=dtype, **options)
+    return pd.arrays.IntervalArray.from_arrays(minimum, maximum, closed="both")
+
+
+def means(series: pd.Series, positions: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    # Averages are summed one partition at a time as pandas does, grouped sums round differently
+    values = series.iloc[positions]
+    missing = values.isna().to_numpy()
+    counts = np.add.reduceat(~missing, starts)
+    if is_extension_array_dtype(values.dtype):
+        # Masked arrays sum only present values, and the average of no values is NA
+        values = values.to_numpy(dtype=np.float64, na_value=np.nan)[~missing]
+        ends = np.cumsum(counts)
+        starts = ends - counts
+    else:
+        # Missing values are summed as zeros, float columns in their own precision
+        values = values.to_numpy(dtype=values.dtype if is_float_dtype(values.dtype) else np.float64, copy=True)
+        values[missing] = 0
+        ends = np.append(starts[1:], len(values))
+    sums = np.array([values[s:e].sum() for s, e in zip(starts, ends)], dtype=values.dtype)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        averages = sums / counts.astype(values.dtype)
+    if is_extension_array_dtype(series.dtype) and (counts == 0).any():
+        # NumPy scalars, as Series.mean() returns them
+        averages = np.array(list(averages), dtype=object)
+        averages[counts == 0] = pd.NA
+    return averages
+
+
+def sensitive_counts(df: DataFrame, sensitive_columns: List[str], positions: np.ndarray, pid: np.ndarray,
+                     n_partitions: int) -> pd.Series:
+    # Number of rows of every combination of sensitive values within each partition, indexed by partition id and
+    # the sensitive values, sorted. Rows with a missing sensitive value are not counted. A single categorical
+    # sensitive column lists every category for every partition, also with count 0.
+    columns = list(dict.fromkeys(sensitive_columns))
+    frame = df[columns].iloc[positions].reset_index(drop=True)
+    keys = [pd.Series(pid)] + [frame[c] for c in columns]
+    # Categorical keys of observed groups are not sorted by groupby
+    counts = frame.groupby(keys, sort=True, observed=True).size().sort_index()
+    if len(columns) == 1 and is_categorical_dtype(frame[columns[0]]):
+        categories = frame[columns[0]].cat.categories
+        full = pd.MultiIndex.from_product([np.arange(n_partitions), categories])
+        counts = counts.reindex(full, fill_value=0)
+    counts.index = counts.index.set_names([None] + columns)
+    return counts
+
+
+def aggregate_grouped(df: DataFrame, partitions, feature_columns: List[str], sensitive_columns: List[str],
+                      avg_columns: List[str] = None, output: str = "lists", avg_overwrite: bool = True) -> dict:
+    # Columns of the anonymized dataframe, None if the rows of partitions cannot be gathered, see gather()
+    gathered = gather(df, partitions)
+    if gathered is None:
+        return None
+    positions, pid, starts = gathered
+    n_partitions = len(partitions)
+    counts = sensitive_counts(df, sensitive_columns, positions, pid, n_partitions)
+    if len(counts) == 0:
+        return {}
+    row_pid = counts.index.get_level_values(0).to_numpy()
+
+    averaged = [c for c in dict.fromkeys(avg_columns or []) if c in feature_columns]
+    columns = {}
+    for column in dict.fromkeys(feature_columns):
+        series = df[column]
+        numeric = is_numeric_dtype(series)
+        if avg_overwrite and column in averaged:
+            # Average is set below, in place of the generalization
+            columns[column] = None
+        elif output == "strings":
+            if numeric:
+                codes, categories = interval_labels(*min_max(series, positions, pid))
+            else:
+                codes, categories = set_labels(series, positions, pid, n_partitions)
+            columns[column] = pd.Categorical.from_codes(codes[row_pid], categories)
+        elif output == "bounds" and numeric:
+            minimum, maximum = min_max(series, positions, pid)
+            columns[column + "_min"] = minimum.take(row_pid)
+            columns[column + "_max"] = maximum.take(row_pid)
+        elif output == "intervals" and numeric:
+            columns[column] = interval_array(*min_max(series, positions, pid)).take(row_pid)
+        elif output != "lists":
+            columns[column] = value_set_categorical(series, positions, pid, n_partitions).take(row_pid)
+        else:
+            if numeric:
+                minimum, maximum = min_max(series, positions, pid)
+                cells = [[a, b] for a, b in zip(minimum, maximum)]
+            else:
+                cells = [[str(n) for n in s] for s in value_sets(series, positions, pid, n_partitions)]
+            columns[column] = [cells[p] for p in row_pid]
+
+    for column in averaged:
+        columns[column if avg_overwrite else column + "_avg"] = means(df[column], positions, starts)[row_pid]
+
+    for j, column in enumerate(dict.fromkeys(sensitive_columns)):
+        columns[column] = counts.index.get_level_values(j + 1).tolist()
+        columns[column + "_count"] = counts.to_numpy()
+    return columns
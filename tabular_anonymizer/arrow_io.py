@@ -0,0 +1,88 @@
+import os
+from typing import List
+
+import pandas as pd
+from pandas import DataFrame
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+"""
+Parquet and Arrow input. Only the requested columns are read, files are memory-mapped, and string columns are
+read dictionary-encoded so they become pandas categories directly, without creating Python string objects.
+"""
+
+PARQUET_SUFFIXES = (".parquet", ".pq")
+ARROW_SUFFIXES = (".arrow", ".feather", ".ipc")
+
+
+def is_arrow_source(source) -> bool:
+    # Parquet or Arrow IPC (Feather v2) file path, or pyarrow Table
+    if isinstance(source, (str, os.PathLike)):
+        return str(source).lower().endswith(PARQUET_SUFFIXES + ARROW_SUFFIXES)
+    return pa is not None and isinstance(source, pa.Table)
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise Exception("Reading Parquet and Arrow input requires pyarrow")
+
+
+def read_schema(source):
+    _require_pyarrow()
+    if isinstance(source, pa.Table):
+        return source.schema
+    if str(source).lower().endswith(PARQUET_SUFFIXES):
+        return pq.read_schema(source, memory_map=True)
+    return pa.ipc.open_file(pa.memory_map(str(source))).schema
+
+
+def read_table(source, columns: List[str], plain: List[str] = ()):
+    # String columns other than plain are read dictionary-encoded from Parquet
+    _require_pyarrow()
+    if isinstance(source, pa.Table):
+        return source.select(columns)
+    if str(source).lower().endswith(PARQUET_SUFFIXES):
+        schema = pq.read_schema(source, memory_map=True)
+        strings = [c for c in columns if _is_string(schema.field(c).type) and c not in plain]
+        return pq.read_table(source, columns=columns, memory_map=True, read_dictionary=strings)
+    # Arrow IPC buffers point to the memory-mapped file, nothing is copied
+    return pa.ipc.open_file(pa.memory_map(str(source))).read_all().select(columns)
+
+
+def _is_string(arrow_type) -> bool:
+    return pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type)
+
+
+def read_columns(source, columns: List[str], plain: List[str] = ()) -> dict:
+    # Columns of source as pandas series with a RangeIndex. Dictionary-encoded and string columns become
+    # categories, except columns in plain, which are read as strings like pandas reads them. Numeric columns
+    # without missing values are not copied. Categories of string columns are sorted, as astype("category") sorts
+    # them, while dictionary-encoded columns keep the order of their dictionary. Missing strings become NaN, not None.
+    columns = list(dict.fromkeys(columns))
+    schema = read_schema(source)
+    table = read_table(source, columns, plain)
+    result = {}
+    for name in columns:
+        column = table.column(name)
+        if name in plain:
+            if pa.types.is_dictionary(column.type) and _is_string(column.type.value_type):
+                column = column.cast(column.type.value_type)
+        elif _is_string(column.type):
+            column = column.dictionary_encode()
+        series = column.to_pandas()
+        if name not in plain and _is_string(schema.field(name).type):
+            series = series.cat.reorder_categories(sorted(series.cat.categories))
+        series.name = name
+        result[name] = series
+    return result
+
+
+def read_dataframe(source, columns: List[str] = None, plain: List[str] = ()) -> DataFrame:
+    if columns is None:
+        columns = read_schema(source).names
+    return pd.DataFrame(read_columns(source, columns, plain))
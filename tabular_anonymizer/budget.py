@@ -0,0 +1,65 @@
+import time
+
+"""
+Anytime partitioning. A Budget is checked before every partition is refined. Once the wall-clock budget runs out or
+cancellation is requested, pending partitions are finished as they are. Every pending partition came from a valid
+split, so the result still satisfies k, l and t, it is only coarser. Progress is reported as rows in finished
+partitions out of all rows.
+"""
+
+
+class Budget:
+    deadline: float = None      # time.monotonic() after which partitions are no longer refined
+    progress = None             # Called with (finished rows, total rows)
+    cancel = None               # Object with is_set(), such as threading.Event, requests cancellation when set
+    interval: float = 0.5       # Minimum seconds between progress calls
+    n_rows: int = 0
+    finished_rows: int = 0
+    stopped: str = None         # "time_budget" or "cancelled" when partitioning was stopped early
+
+    def __init__(self, n_rows: int, time_budget: float = None, progress=None, cancel=None,
+                 interval: float = 0.5) -> None:
+        self.deadline = None if time_budget is None else time.monotonic() + time_budget
+        self.progress = progress
+        self.cancel = cancel
+        self.interval = interval
+        self.n_rows = n_rows
+        self.finished_rows = 0
+        self.stopped = None
+        self._reported = time.monotonic()
+
+    @classmethod
+    def create(cls, n_rows: int, time_budget: float = None, progress=None, cancel=None):
+        # None when there is nothing to check, so that partitioning runs without overhead
+        if time_budget is None and progress is None and cancel is None:
+            return None
+        return cls(n_rows, time_budget, progress, cancel)
+
+    def exhausted(self) -> bool:
+        if self.stopped is None:
+            if self.cancel is not None and self.cancel.is_set():
+                self.stopped = "cancelled"
+            elif self.deadline is not None and time.monotonic() >= self.deadline:
+                self.stopped = "time_budget"
+        return self.stopped is not None
+
+    def add(self, rows: int) -> None:
+        self.finished_rows += rows
+        if self.progress is not None:
+            now = time.monotonic()
+            if now - self._reported >= self.interval:
+                self._reported = now
+                self.progress(self.finished_rows, self.n_rows)
+
+    def done(self) -> None:
+        # Rows left out of all partitions (missing values of split columns) are final as well
+        self.finished_rows = self.n_rows
+        if self.progress is not None:
+            self.progress(self.n_rows, self.n_rows)
+
+    def worker_budget(self, cancel=None):
+        # Deadline only, progress and the caller's cancellation stay in the main process
+        budget = Budget(self.n_rows, interval=self.interval)
+        budget.deadline = self.deadline
+        budget.cancel = cancel
+        return budget
@@ -1,3 +1,4 @@
+import warnings
 from typing import List
 
 import pandas as pd
@@ -5,18 +6,42 @@ from pandas import DataFrame
 from pandas.core.dtypes.common import is_numeric_dtype
 from pandas.core.indexes.numeric import NumericIndex
 
+from .aggregation import OUTPUTS, aggregate_grouped
+from .arrow_io import is_arrow_source, read_dataframe, read_schema
 from .mondrian_anonymizer import MondrianAnonymizer
+from .output_writer import BatchWriter
+from .partition_cache import PartitionCache
+from .partition_labels import PartitionLabels
+from .stats import AnonymizationStats, phase
 
 
 class DataFrameAnonymizer:
     AVG_OVERWRITE = True
+    # Build the anonymized dataframe with grouped operations over all partitions instead of partition by partition
+    GROUPED_BUILD = True
     mondrian: MondrianAnonymizer    # takes care of partitioning dataframe using mondrian algorithm
+    cache: PartitionCache = None    # reuses partitions of earlier runs with the same data and parameters
+    stopped: str = None     # "time_budget" or "cancelled" if partitioning of the latest run was stopped early
+    output: str = "lists"   # form of generalized values, one of aggregation.OUTPUTS
 
-    def __init__(self, sensitive_attribute_columns: List[str], feature_columns=None, avg_columns=None, format_to_str=False):
+    # output="bounds" or "intervals" gives native columns instead of Python lists, see aggregation.py
+    def __init__(self, sensitive_attribute_columns: List[str], feature_columns=None, avg_columns=None, format_to_str=False,
+                 engine="numpy", presort=False, categorical_split="appearance", bins=None, cache=None, output=None):
+        if output is not None and output not in OUTPUTS:
+            raise Exception("Unknown output " + str(output) + ", use one of: " + ", ".join(OUTPUTS))
+        if format_to_str and output not in (None, "strings"):
+            raise Exception("format_to_str cannot be combined with output " + output)
         self.sensitive_attribute_columns = sensitive_attribute_columns
         self.feature_columns = feature_columns
         self.avg_columns = avg_columns
-        self.format_to_str = format_to_str
+        self.format_to_str = format_to_str or output == "strings"
+        self.output = output or ("strings" if format_to_str else "lists")
+        self.engine = engine
+        self.presort = presort
+        self.categorical_split = categorical_split
+        self.bins = bins
+        self.cache = cache
+        self.stopped = None
 
     # Set feature colums from all other columns than sensitive columns
     def init_feature_colums(self, df):
@@ -29,13 +54,78 @@ class DataFrameAnonymizer:
                     fc.append(col)
             self.feature_columns = fc
 
-    def anonymize(self, df, k, l=0):
+    # Parquet or Arrow file path, or pyarrow Table: only feature, sensitive and average columns are read
+    # and string feature columns are read directly as categories
+    def read_source(self, source) -> DataFrame:
+        if not is_arrow_source(source):
+            return source
+        if not self.feature_columns:
+            names = read_schema(source).names
+            self.feature_columns = [c for c in names if c not in self.sensitive_attribute_columns]
+        columns = list(self.feature_columns) + list(self.sensitive_attribute_columns) + list(self.avg_columns or [])
+        # Sensitive values are output as read, string columns as strings like with DataFrame input
+        return read_dataframe(source, columns, plain=self.sensitive_attribute_columns)
 
-        # Check inputs
-        if df is None or len(df) == 0:
-            raise Exception("Dataframe is empty")
+    def create_mondrian(self, df) -> MondrianAnonymizer:
+        # Anonymized dataframe is built from the original dataframe, so numpy engine only needs
+        # feature and sensitive columns and the dataframe is not copied
+        return MondrianAnonymizer(df, self.feature_columns, self.sensitive_attribute_columns, engine=self.engine,
+                                  presort=self.presort, categorical_split=self.categorical_split,
+                                  copy=self.engine == "pandas", bins=self.bins)
+
+    # stats=True returns (anonymized dataframe, AnonymizationStats) with time of phases, split counts, depth and
+    # partition sizes. A given AnonymizationStats (for memory tracing or a callback) is filled in instead.
+    # time_budget, progress and cancel limit partitioning, see MondrianAnonymizer.partition() and stopped.
+    def anonymize(self, df, k, l=0, n_jobs=1, traversal="bfs", t=None, stats=None, time_budget=None, progress=None,
+                  cancel=None):
+        created = stats is True
+        if created:
+            stats = AnonymizationStats()
+        df = self.__check_input(df, t, stats)
+        # Native outputs are built from labels, which also identify rows of a non-unique index
+        partitions = self.partition_dataframe(df, k, l, n_jobs=n_jobs, traversal=traversal, t=t, stats=stats,
+                                              time_budget=time_budget, progress=progress, cancel=cancel,
+                                              as_labels=self.output not in ("lists", "strings"))
+        dfa = self.build_anonymized_dataframe(df, partitions, stats=stats)
+        return (dfa, stats) if created else dfa
+
+    # Writes the anonymized dataframe to a CSV or Parquet file (format from the suffix of path by default) in
+    # batches of partitions with at most batch_rows input rows, one CSV chunk or Parquet row group per batch.
+    # Batches are written in a background thread while the next one is built. Returns the number of rows written,
+    # with stats=True (rows, AnonymizationStats). Other keyword arguments are passed to the writer, see BatchWriter.
+    def anonymize_to(self, df, path, k, l=0, format=None, batch_rows=100000, n_jobs=1, traversal="bfs", t=None,
+                     stats=None, time_budget=None, progress=None, cancel=None, **write_options):
+        created = stats is True
+        if created:
+            stats = AnonymizationStats()
+        df = self.__check_input(df, t, stats)
+        partitions = self.partition_dataframe(df, k, l, n_jobs=n_jobs, traversal=traversal, t=t, stats=stats,
+                                              time_budget=time_budget, progress=progress, cancel=cancel,
+                                              as_labels=True)
+        # Batches only hold the columns that are aggregated
+        columns = list(self.feature_columns) + list(self.sensitive_attribute_columns) + list(self.avg_columns or [])
+        columns = df.columns.get_indexer(list(dict.fromkeys(columns)))
+        writer = BatchWriter(path, format, **write_options)
+        try:
+            for rows, labels in partitions.batches(batch_rows):
+                batch = df.iloc[rows, columns]
+                labels.index = batch.index
+                writer.write(self.build_anonymized_dataframe(batch, labels, stats=stats))
+        finally:
+            writer.close()
+            if stats is not None:
+                stats.add_time("write", writer.seconds)
+        return (writer.rows, stats) if created else writer.rows
+
+    def __check_input(self, df, t, stats: AnonymizationStats) -> DataFrame:
         if self.sensitive_attribute_columns is None or len(self.sensitive_attribute_columns) == 0:
             raise Exception("Provide at least one sensitive attribute column")
+        with phase(stats, "read"):
+            df = self.read_source(df)
+        if df is None or len(df) == 0:
+            raise Exception("Dataframe is empty")
+        if t is not None and t < 0:
+            raise Exception("t must be zero or positive")
 
         if not self.feature_columns:
             self.init_feature_colums(df)
@@ -44,11 +134,23 @@ class DataFrameAnonymizer:
             for c in self.avg_columns:
                 if not is_numeric_dtype(df[c]):
                     raise Exception("Column " + c + " is not numeric and average cannot be calculated.")
+        return df
 
-        mondrian = MondrianAnonymizer(df, self.feature_columns, self.sensitive_attribute_columns)
-        partitions = mondrian.partition(k, l)
-        dfa = self.build_anonymized_dataframe(df, partitions)
-        return dfa
+    def anonymize_sweep(self, df, k_values: List[int], l_values: List[int] = None, n_jobs=1, traversal="bfs") -> dict:
+        # Anonymize with several parameters from a single Mondrian run. Partition tree is built with
+        # the smallest k and l, other parameters are produced by cutting the tree.
+        # Returns dictionary of anonymized dataframes keyed by (k, l).
+        df = self.read_source(df)
+        if not self.feature_columns:
+            self.init_feature_colums(df)
+        l_values = l_values or [0]
+        mondrian = self.create_mondrian(df)
+        tree = mondrian.build_tree(min(k_values), min(l_values), n_jobs=n_jobs, traversal=traversal)
+        results = {}
+        for k in k_values:
+            for l in l_values:
+                results[(k, l)] = self.build_anonymized_dataframe(df, tree.partitions(k, l))
+        return results
 
     def anonymize_k_anonymity(self, df, k) -> DataFrame:
         return self.anonymize(df, k)
@@ -56,8 +158,12 @@ class DataFrameAnonymizer:
     def anonymize_l_diversity(self, df, k, l) -> DataFrame:
         return self.anonymize(df, k, l=l)
 
-    def anonymize_t_closeness(self, df, k) -> DataFrame:
-        return self.anonymize(df, k)
+    # Without t only k-anonymity is applied, as in earlier versions. This call form is deprecated.
+    def anonymize_t_closeness(self, df, k, t=None) -> DataFrame:
+        if t is None:
+            warnings.warn("anonymize_t_closeness() without t applies only k-anonymity and is deprecated, "
+                          "pass t or use anonymize_k_anonymity()", DeprecationWarning, stacklevel=2)
+        return self.anonymize(df, k, t=t)
 
     @staticmethod
     def __agg_column_str(series):
@@ -67,7 +173,7 @@ class DataFrameAnonymizer:
             return "{min} - {max}".format(min=minimum, max=maximum)
         else:
             series.astype("category")
-            l = [str(n) for n in set(series)]
+            l = sorted([str(n) for n in set(series)])
             return ", ".join(l)
 
     @staticmethod
@@ -81,24 +187,86 @@ class DataFrameAnonymizer:
             l = [str(n) for n in set(series)]
             return l
 
-    def partition_dataframe(self, df, k, l=0) -> List[NumericIndex]:
-        mondrian = MondrianAnonymizer(df, self.feature_columns, self.sensitive_attribute_columns)
-        partitions = mondrian.partition(k, l)
-        return partitions
-
-    def build_anonymized_dataframe(self, df, partitions) -> DataFrame:
-        aggregations = {}
-        sensitive_columns = self.sensitive_attribute_columns
-        feature_columns = self.feature_columns
+    # as_labels=True returns PartitionLabels instead of a list of indexes, see MondrianAnonymizer.partition()
+    def partition_dataframe(self, df, k, l=0, n_jobs=1, traversal="bfs", t=None, stats: AnonymizationStats = None,
+                            time_budget=None, progress=None, cancel=None, as_labels=False) -> List[NumericIndex]:
+        self.stopped = None
+        df = self.read_source(df)
+        if not self.feature_columns:
+            self.init_feature_colums(df)
+        # Cached partitions are stored by row position, so the index must identify rows
+        key = None
+        if self.cache is not None and df.index.is_unique:
+            key = self.cache_key(df, k, l, n_jobs, traversal, t)
+            with phase(stats, "cache"):
+                labels = self.cache.get_labels(key)
+            if labels is not None:
+                labels.index = df.index
+                partitions = labels if as_labels else labels.partitions()
+                if stats is not None:
+                    stats.add_partitions(partitions)
+                return partitions
+        with phase(stats, "prepare"):
+            mondrian = self.create_mondrian(df)
+        # Cached partitions are stored as labels
+        labelled = as_labels or key is not None
+        partitions = mondrian.partition(k, l, n_jobs=n_jobs, traversal=traversal, t=t, stats=stats,
+                                        time_budget=time_budget, progress=progress, cancel=cancel, as_labels=labelled)
+        self.stopped = mondrian.stopped
+        # Coarser partitions of a stopped run are not cached
+        if key is not None and self.stopped is None:
+            self.cache.put(key, partitions, len(df))
+        return partitions.partitions() if labelled and not as_labels else partitions
 
+    def cache_key(self, df, k, l=0, n_jobs=1, traversal="bfs", t=None) -> str:
+        # Only parameters that change the partitions or their order are part of the key
+        columns = list(self.feature_columns) + list(self.sensitive_attribute_columns)
+        return PartitionCache.fingerprint(df, list(dict.fromkeys(columns)), feature_columns=self.feature_columns,
+                                          sensitive_columns=self.sensitive_attribute_columns, k=k, l=l, t=t,
+                                          n_jobs=n_jobs, traversal=traversal,
+                                          categorical_split=self.categorical_split, bins=self.bins)
 
-        sa_len = len(sensitive_columns)
-        for column in feature_columns:
+    # partitions may also be PartitionLabels of df
+    def build_anonymized_dataframe(self, df, partitions, stats: AnonymizationStats = None) -> DataFrame:
+        if isinstance(partitions, PartitionLabels) and len(partitions.labels) != len(df):
+            raise Exception("Partition labels do not match the dataframe")
+        aggregations = {}
+        for column in self.feature_columns:
             if self.format_to_str:
                 aggregations[column] = self.__agg_column_str
             else:
                 aggregations[column] = self.__agg_column_list
 
+        with phase(stats, "aggregate"):
+            columns = None
+            # Native outputs are only built with grouped operations
+            native = self.output not in ("lists", "strings")
+            if self.GROUPED_BUILD or native:
+                columns = aggregate_grouped(df, partitions, self.feature_columns, self.sensitive_attribute_columns,
+                                            self.avg_columns, self.output, self.AVG_OVERWRITE)
+            if columns is None and native:
+                raise Exception("Output " + self.output + " requires non-empty partitions of a unique index, "
+                                "or partition labels")
+            if columns is None:
+                if isinstance(partitions, PartitionLabels):
+                    partitions = partitions.partitions(df.index)
+                rows = self.__aggregate_partitions(df, partitions, aggregations)
+        with phase(stats, "construct"):
+            if columns is not None:
+                return pd.DataFrame(columns)
+            dfa = pd.DataFrame(rows)
+            if self.format_to_str:
+                # Formatted generalizations are categorical, as in the grouped build
+                averaged = self.avg_columns if self.AVG_OVERWRITE and self.avg_columns else []
+                for column in self.feature_columns:
+                    if column in dfa and column not in averaged and column not in self.sensitive_attribute_columns:
+                        dfa[column] = dfa[column].astype("category")
+            return dfa
+
+    def __aggregate_partitions(self, df, partitions, aggregations) -> list:
+        sensitive_columns = self.sensitive_attribute_columns
+        feature_columns = self.feature_columns
+        sa_len = len(sensitive_columns)
         rows = []
         for i, partition in enumerate(partitions):
             dfp = df.loc[partition]
@@ -129,4 +297,4 @@ class DataFrameAnonymizer:
                         }
                     )
                 rows.append(values.copy())
-        return pd.DataFrame(rows)
+        return rows
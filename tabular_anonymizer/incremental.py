@@ -0,0 +1,222 @@
+from typing import List
+
+import pandas as pd
+from pandas import DataFrame
+
+from .dataframe_anonymizer import DataFrameAnonymizer
+from .mondrian_anonymizer import MondrianAnonymizer
+from .partition_tree import PartitionTree
+
+"""
+Incremental anonymization. The partition tree of the first run is kept together with the rows of every leaf.
+Appended rows are routed to their leaf through the recorded splits, and leaves that grow to 2k rows or more are
+split again. Leaves that are no longer valid after deletions are merged with their siblings. Only the output
+rows of changed leaves are rebuilt, and they are returned as a delta.
+"""
+
+
+class IncrementalAnonymizer:
+    anonymizer: DataFrameAnonymizer     # builds output rows of each leaf
+    tree: PartitionTree = None  # Splits of the current partitioning, leaves are the partitions
+    frames: dict = {}           # Rows of each leaf
+    output: dict = {}           # Anonymized rows of each leaf
+    parents: dict = {}          # Parent node of each node
+    k: int = 0
+    l: int = 0
+
+    # Other keyword arguments (presort, categorical_split) are passed to DataFrameAnonymizer
+    def __init__(self, sensitive_attribute_columns: List[str], feature_columns=None, avg_columns=None,
+                 format_to_str=False, **options):
+        self.anonymizer = DataFrameAnonymizer(sensitive_attribute_columns, feature_columns=feature_columns,
+                                              avg_columns=avg_columns, format_to_str=format_to_str, **options)
+        self.tree = None
+        self.frames = {}
+        self.output = {}
+        self.parents = {}
+
+    def fit(self, df: DataFrame, k: int, l: int = 0) -> DataFrame:
+        # Partition df and return the anonymized dataframe. Index of the result is the partition (leaf) id.
+        a = self.anonymizer
+        if df is None or len(df) == 0:
+            raise Exception("Dataframe is empty")
+        if not a.sensitive_attribute_columns:
+            raise Exception("Provide at least one sensitive attribute column")
+        if not df.index.is_unique:
+            raise Exception("Index of the dataframe must be unique")
+        if not a.feature_columns:
+            a.init_feature_colums(df)
+        self.k = k
+        self.l = l
+        self.tree = None
+        self.frames = {}
+        self.output = {}
+        self.parents = {}
+        for node in self.__split(None, df):
+            self.output[node] = self.__anonymize(node)
+        return self.anonymized()
+
+    def anonymized(self) -> DataFrame:
+        return self.__concat([self.output[node] for node in sorted(self.output)])
+
+    def update(self, appended: DataFrame = None, deleted: DataFrame = None) -> (List[int], DataFrame):
+        # Apply appended and deleted rows. Deleted rows are identified by their index label and need the feature
+        # columns for finding their leaf, deleting rows that are not in any leaf raises. Appended rows need index
+        # labels that are not used by other rows. Returns ids of partitions whose output rows must be removed and
+        # the new output rows, indexed by partition id.
+        if self.tree is None:
+            raise Exception("Call fit() before update()")
+        if appended is not None and len(appended):
+            self.__check_labels(appended, deleted)
+        changed = set()
+        grown = set()
+        if deleted is not None and len(deleted):
+            for node, labels in self.__find(deleted).items():
+                self.frames[node] = self.frames[node].drop(labels)
+                changed.add(node)
+        if appended is not None and len(appended):
+            for node, rows in self.__route(appended):
+                self.frames[node] = pd.concat([self.frames[node], appended.iloc[rows]])
+                changed.add(node)
+                grown.add(node)
+        # Merge leaves that are no longer valid, a merged leaf may have grown enough to be split differently
+        for node in sorted(changed):
+            if node in self.frames and not self.is_valid(self.frames[node]):
+                merged, removed = self.__merge(node)
+                changed.update(removed)
+                changed.add(merged)
+                grown.add(merged)
+        # Leaf can be split only when it has at least 2k rows
+        for node in sorted(grown):
+            if node in self.frames and len(self.frames[node]) >= 2 * self.k:
+                changed.update(self.__split(node, self.frames.pop(node)))
+                changed.add(node)
+        removed = []
+        added = []
+        for node in sorted(changed):
+            if node in self.output:
+                del self.output[node]
+                removed.append(node)
+            if node in self.frames:
+                self.output[node] = self.__anonymize(node)
+                added.append(self.output[node])
+        return removed, self.__concat(added)
+
+    def is_valid(self, frame: DataFrame) -> bool:
+        if len(frame) < self.k:
+            return False
+        if self.l > 0:
+            for column in self.anonymizer.sensitive_attribute_columns:
+                if frame[column].nunique(dropna=False) < self.l:
+                    return False
+        return True
+
+    def __route(self, df: DataFrame, node: int = 0):
+        # Row positions of df grouped by leaf
+        nodes = self.tree.route(df, node)
+        return pd.Series(nodes).groupby(nodes, sort=False).indices.items()
+
+    def __check_labels(self, appended: DataFrame, deleted: DataFrame = None) -> None:
+        # Deletions find rows by index label, so labels must stay unique. Labels of rows deleted in the same update
+        # can be reused.
+        if not appended.index.is_unique:
+            raise Exception("Index of appended rows must be unique")
+        labels = appended.index if deleted is None else appended.index.difference(deleted.index)
+        for frame in self.frames.values():
+            used = labels.intersection(frame.index)
+            if len(used):
+                raise Exception("Appended rows have index labels of existing rows: " +
+                                ", ".join(str(label) for label in used[:10]))
+
+    def __find(self, df: DataFrame) -> dict:
+        # Index labels of rows of df grouped by the leaf they are in. Rows are looked up in the leaf they are routed
+        # to, and in all leaves if they are not there (feature values changed since the rows were added).
+        found = {}
+        missing = []
+        for node, rows in self.__route(df):
+            labels = df.index[rows]
+            present = labels.isin(self.frames[node].index)
+            if present.any():
+                found[node] = labels[present]
+            missing.extend(labels[~present])
+        if missing:
+            missing = pd.Index(missing)
+            for node, frame in self.frames.items():
+                labels = missing.intersection(frame.index)
+                if len(labels):
+                    found[node] = found[node].append(labels) if node in found else labels
+                    missing = missing.difference(labels)
+            if len(missing):
+                raise Exception("Deleted rows not found: " + ", ".join(str(label) for label in missing[:10]))
+        return found
+
+    def __split(self, node: int, frame: DataFrame) -> List[int]:
+        # Partition rows of a leaf (or the whole table when node is None) and attach the resulting subtree.
+        # Returns the new leaves.
+        a = self.anonymizer
+        mondrian = MondrianAnonymizer(frame, a.feature_columns, a.sensitive_attribute_columns, presort=a.presort,
+                                      categorical_split=a.categorical_split, copy=False)
+        subtree = mondrian.build_tree(self.k, self.l)
+        if node is None:
+            self.tree = subtree
+            ids = {n: n for n in range(len(subtree))}
+        else:
+            ids = self.tree.graft(node, subtree)
+        for n in range(len(subtree)):
+            if subtree.left[n] >= 0:
+                self.parents[ids[subtree.left[n]]] = ids[n]
+                self.parents[ids[subtree.right[n]]] = ids[n]
+        leaves = [ids[n] for n in subtree.rows]
+        for n, rows in subtree.rows.items():
+            self.frames[ids[n]] = frame.iloc[rows]
+        # Rows with missing value in a numeric split column went to neither child, route them to the right
+        # like appended rows, so no rows are lost
+        for n, rows in subtree.dropped.items():
+            dropped = frame.iloc[rows]
+            for leaf, positions in self.__route(dropped, ids[n]):
+                self.frames[leaf] = pd.concat([self.frames[leaf], dropped.iloc[positions]])
+        # Row positions refer to the partitioned frame, leaf rows are kept in frames instead
+        self.tree.rows.clear()
+        self.tree.dropped.clear()
+        return leaves
+
+    def __merge(self, node: int) -> (int, List[int]):
+        # Collapse parents of an invalid leaf until the merged leaf is valid, or the root is reached.
+        # Returns the merged leaf and the leaves that were removed.
+        removed = []
+        while node in self.parents and not self.is_valid(self.frames[node]):
+            node = self.parents[node]
+            leaves = self.__leaves(node)
+            self.frames[node] = pd.concat([self.frames.pop(leaf) for leaf in leaves])
+            removed.extend(leaves)
+            self.tree.left[node] = -1
+            self.tree.right[node] = -1
+            self.tree.columns[node] = None
+            self.tree.values[node] = None
+        return node, removed
+
+    def __leaves(self, node: int) -> List[int]:
+        leaves = []
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            if self.tree.is_leaf(n):
+                leaves.append(n)
+            else:
+                stack.extend((self.tree.right[n], self.tree.left[n]))
+        return leaves
+
+    def __anonymize(self, node: int) -> DataFrame:
+        frame = self.frames[node]
+        # A leaf is invalid only if merging reached the root, its rows are withheld until enough rows are appended
+        if len(frame) == 0 or not self.is_valid(frame):
+            return DataFrame()
+        dfa = self.anonymizer.build_anonymized_dataframe(frame, [frame.index])
+        dfa.index = pd.Index([node] * len(dfa), name="partition")
+        return dfa
+
+    @staticmethod
+    def __concat(frames: List[DataFrame]) -> DataFrame:
+        frames = [f for f in frames if len(f)]
+        if not frames:
+            return DataFrame()
+        return pd.concat(frames)
@@ -1,6 +1,16 @@
+from collections import deque
 from typing import List
+
+import numpy as np
 from pandas.api.types import is_numeric_dtype
-from pandas import Int64Index, DataFrame
+from pandas import Index, Int64Index, DataFrame, RangeIndex
+
+from .arrow_io import is_arrow_source, read_columns
+from .budget import Budget
+from .mondrian_engine import NumpyMondrianEngine, earth_movers_distance
+from .partition_labels import PartitionLabels
+from .partition_tree import PartitionTree
+from .stats import AnonymizationStats, phase
 
 """
 Modified and optimized version of anonypy Mondrian that supports multiple sensitive attributes. 
@@ -12,18 +22,68 @@ class MondrianAnonymizer:
     sensitive_columns: List[str] = []  # This data will not get altered
     max_split_count: int = 1000000  # failsafe that prevents algorithm to get stuck to infinite loop
     split_count: int = 0
+    failed_splits: int = 0  # Split attempts rejected because a child would not be valid
+    stopped: str = None     # "time_budget" or "cancelled" if the latest partitioning was stopped early
     avg_columns: List[str] = []  # Numeric columns that are converted to average value after partitioning
     df: DataFrame = None    # Original dataframe
+    columns: dict = None    # Prepared feature and sensitive columns, without copying the dataframe (copy=False)
+    index: Index = None     # Index of the original dataframe
+    # "numpy" partitions on NumPy arrays, "pandas" on pandas indexes. "numba" is the numpy engine with the
+    # partitioning loop compiled with Numba, it falls back to the numpy engine if Numba is not installed.
+    engine: str = "numpy"
+    presort: bool = False   # numpy engine: sort numeric columns once instead of finding medians on every split
+    # numpy engine: categories of a categorical column are halved in order of appearance in the partition,
+    # or in category "order" (order of ordered categoricals), which does not depend on the order of the rows
+    categorical_split: str = "appearance"
+    # numpy engine: approximate mode, numeric feature columns are binned to at most bins quantile bins
+    # and split on bin boundaries
+    bins: int = None
     _DEFAULT_K: int = 3
+    ENGINES = ("numpy", "pandas", "numba")
+    CATEGORICAL_SPLITS = ("appearance", "order")
+    TRAVERSALS = ("bfs", "dfs")
 
-    def __init__(self, df: DataFrame, feature_columns: List[str], sensitive_columns: List[str]) -> None:
-        # prepare dataframe for partitioning
-        self.df = self.prepare_dataframe(df)
+    # df can also be a Parquet or Arrow file path, or a pyarrow Table: only feature and sensitive columns are read
+    def __init__(self, df: DataFrame, feature_columns: List[str], sensitive_columns: List[str],
+                 engine: str = "numpy", presort: bool = False, categorical_split: str = "appearance",
+                 copy: bool = True, bins: int = None) -> None:
+        if engine not in self.ENGINES:
+            raise Exception("Unknown engine " + str(engine) + ", use one of: " + ", ".join(self.ENGINES))
+        if categorical_split not in self.CATEGORICAL_SPLITS:
+            raise Exception("Unknown categorical split " + str(categorical_split) + ", use one of: " +
+                            ", ".join(self.CATEGORICAL_SPLITS))
+        if engine == "pandas" and categorical_split != "appearance":
+            raise Exception("Categorical split " + categorical_split + " requires numpy engine")
+        if engine == "pandas" and not copy:
+            raise Exception("Preparing without copy requires numpy engine")
+        if bins is not None and engine == "pandas":
+            raise Exception("Binning requires numpy engine")
+        if bins is not None and bins < 2:
+            raise Exception("bins must be at least 2")
         if not feature_columns:
             raise Exception("Feature columns is mandatory parameter")
+        if is_arrow_source(df):
+            df = read_columns(df, list(feature_columns) + list(sensitive_columns or []))
+            df = DataFrame(df) if copy else df
+        # prepare dataframe for partitioning
+        if copy:
+            self.df = self.prepare_dataframe(df)
+            self.columns = self.df
+        else:
+            self.df = None
+            self.columns = self.prepare_columns(df, list(feature_columns) + list(sensitive_columns or []))
+        self.index = df.index if isinstance(df, DataFrame) else RangeIndex(len(self.columns[feature_columns[0]]))
+        self._numpy_engine = None
+        self._distributions = None
         self.sensitive_columns = sensitive_columns
         self.feature_columns = feature_columns
         self.split_count = 0
+        self.failed_splits = 0
+        self.stopped = None
+        self.engine = engine
+        self.presort = presort
+        self.categorical_split = categorical_split
+        self.bins = bins
 
     def prepare_dataframe(self, df_orig: DataFrame):
         df = df_orig.__deepcopy__()
@@ -35,7 +95,17 @@ class MondrianAnonymizer:
 
         return df
 
-    def is_valid(self, partition: Int64Index, k: int = _DEFAULT_K, l: int = 0) -> bool:
+    def prepare_columns(self, df: DataFrame, columns: List[str]) -> dict:
+        # Only the given columns are prepared and the dataframe is not copied. Numeric columns are used as such,
+        # non-numerical columns are converted to category once.
+        prepared = {}
+        for col in columns:
+            if col not in prepared:
+                series = df[col]
+                prepared[col] = series if is_numeric_dtype(series) else series.astype("category")
+        return prepared
+
+    def is_valid(self, partition: Int64Index, k: int = _DEFAULT_K, l: int = 0, t: float = None) -> bool:
         # k-anonymous
         if not self.is_k_anonymous(partition, k):
             return False
@@ -47,6 +117,11 @@ class MondrianAnonymizer:
                 )
                 if not diverse:
                     return False
+        # t-close
+        if t is not None and self.sensitive_columns is not None:
+            for sensitive_column in self.sensitive_columns:
+                if not self.is_t_close(self.df, partition, sensitive_column, t):
+                    return False
         return True
 
     def is_k_anonymous(self, partition, k):
@@ -58,6 +133,24 @@ class MondrianAnonymizer:
         diversity = len(df.loc[partition][sensitive_column].unique())
         return diversity >= l
 
+    def is_t_close(self, df, partition, sensitive_column, t):
+        # Distribution of sensitive values in partition must be within distance t from distribution of the whole table
+        distribution = self.get_distribution(df, sensitive_column)
+        p = df.loc[partition][sensitive_column].value_counts(normalize=True, dropna=False)
+        p = p.reindex(distribution.index, fill_value=0)
+        dtype = df[sensitive_column].dtype
+        ordered = dtype.ordered if dtype.name == "category" else is_numeric_dtype(dtype)
+        return earth_movers_distance(p.to_numpy(), distribution.to_numpy(), ordered) <= t
+
+    def get_distribution(self, df, sensitive_column):
+        # Distribution of sensitive values in the whole table, in order of the values, missing values first
+        if self._distributions is None:
+            self._distributions = {}
+        if sensitive_column not in self._distributions:
+            distribution = df[sensitive_column].value_counts(normalize=True, dropna=False)
+            self._distributions[sensitive_column] = distribution.sort_index(na_position="first")
+        return self._distributions[sensitive_column]
+
     def get_spans(self, partition: Int64Index, scale: dict = None) -> dict:
         spans = {}
         # get subset of original dataframe representing this partition and use it for faster calculations
@@ -90,20 +183,136 @@ class MondrianAnonymizer:
             dfr = dfp.index[dfp >= median]
             return dfl, dfr
 
-    def partition(self, k: int = _DEFAULT_K, l: int = 0) -> object:
+    def partition(self, k: int = _DEFAULT_K, l: int = 0, n_jobs: int = 1, parallel_rows: int = None,
+                  parallel_depth: int = None, traversal: str = "bfs", t: float = None, stats=None,
+                  time_budget: float = None, progress=None, cancel=None, as_labels: bool = False) -> object:
+        # n_jobs > 1 (or -1 for all cores) partitions independent subtrees in a process pool (numpy engine).
+        # Subtrees with at most parallel_rows rows, or at parallel_depth, are handed to the pool.
+        # traversal "bfs" processes partitions breadth-first from a queue. "dfs" processes them depth-first
+        # from a stack, so only partitions along one path of the tree are pending and memory is bounded by depth.
+        # t enables t-closeness: distance of sensitive value distribution of every partition from the
+        # distribution of the whole table is at most t.
+        # stats=True returns (partitions, AnonymizationStats) with time of phases and split counts. A given
+        # AnonymizationStats (for memory tracing or a callback) is filled in and partitions are returned as usual.
+        # Anytime mode: after time_budget seconds, or once cancel.is_set() (e.g. threading.Event), partitions are
+        # no longer refined and the valid partitions found so far are returned, see stopped.
+        # progress(finished rows, total rows) is called during partitioning. The numba engine uses the numpy
+        # implementation in anytime mode.
+        # as_labels=True returns PartitionLabels: partition id of every row and rows grouped by partition,
+        # instead of a list of indexes.
+        if traversal not in self.TRAVERSALS:
+            raise Exception("Unknown traversal " + str(traversal) + ", use one of: " + ", ".join(self.TRAVERSALS))
+        created = stats is True
+        if created:
+            stats = AnonymizationStats()
+        budget = Budget.create(len(self.index), time_budget, progress, cancel)
+        if self.engine != "pandas":
+            positions = self.__partition_numpy(k, l, n_jobs, parallel_rows, parallel_depth, traversal, t, stats,
+                                               budget)
+            if as_labels:
+                partitions = PartitionLabels.from_positions(positions, len(self.index), self.index)
+            else:
+                # Convert row positions back to index labels of the original dataframe
+                partitions = [self.index[p] for p in positions]
+        else:
+            with phase(stats, "partition"):
+                partitions = self.__partition_pandas(k, l, n_jobs, traversal, t, budget)
+            if as_labels:
+                partitions = PartitionLabels.from_partitions(partitions, self.index)
+        self.stopped = None
+        if budget is not None:
+            self.stopped = budget.stopped
+            budget.done()
+        if stats is not None:
+            stats.split_count += self.split_count
+            stats.failed_splits += self.failed_splits
+            stats.add_partitions(partitions)
+        return (partitions, stats) if created else partitions
+
+    def __partition_pandas(self, k: int, l: int, n_jobs: int, traversal: str, t: float,
+                           budget: Budget = None) -> List[Int64Index]:
+        if n_jobs != 1:
+            raise Exception("Parallel partitioning requires numpy engine")
+        self.split_count = 0
+        self.failed_splits = 0
         scale = self.get_spans(self.df.index)
         finished_partitions = []
-        partitions = [self.df.index]
+        partitions = deque([self.df.index])
+        pop = partitions.popleft if traversal == "bfs" else partitions.pop
         while partitions:
-            partition = partitions.pop(0)
+            partition = pop()
+            if budget is not None and budget.exhausted():
+                # Out of time or cancelled, pending partitions came from valid splits
+                self.__finish(partition, finished_partitions, budget)
+                continue
+            if k >= 1 and len(partition) < 2 * k:
+                # No split can give two children of k rows
+                self.__finish(partition, finished_partitions, budget)
+                continue
             spans = self.get_spans(partition, scale)
             sorted_items = sorted(spans.items(), key=lambda x: -x[1])
             for column, span in sorted_items:
                 lp, rp = self.split(column, partition)
-                if not self.is_valid(lp, k, l) or not self.is_valid(rp, k, l):
+                if not self.is_valid(lp, k, l, t) or not self.is_valid(rp, k, l, t):
+                    self.failed_splits += 1
                     continue
-                partitions.extend((lp, rp))
+                if budget is not None:
+                    # Rows with missing value in a numeric split column are left out
+                    budget.add(len(partition) - len(lp) - len(rp))
+                # Left partition is processed first in both traversals
+                partitions.extend((lp, rp) if traversal == "bfs" else (rp, lp))
                 break
             else:
-                finished_partitions.append(partition)
+                self.__finish(partition, finished_partitions, budget)
         return finished_partitions
+
+    @staticmethod
+    def __finish(partition: Int64Index, finished_partitions: list, budget: Budget = None) -> None:
+        if budget is not None:
+            budget.add(len(partition))
+        finished_partitions.append(partition)
+
+    def __numpy_engine(self, traversal: str = "bfs") -> NumpyMondrianEngine:
+        # Column arrays and category codes are built once and reused by later calls
+        if self._numpy_engine is None:
+            self._numpy_engine = NumpyMondrianEngine(self.columns, self.feature_columns, self.sensitive_columns,
+                                                     self.max_split_count, presort=self.presort,
+                                                     categorical_split=self.categorical_split,
+                                                     compiled=self.engine == "numba", bins=self.bins)
+        engine = self._numpy_engine
+        engine.traversal = traversal
+        engine.split_count = 0
+        engine.failed_splits = 0
+        return engine
+
+    def __partition_numpy(self, k: int, l: int, n_jobs: int, parallel_rows: int, parallel_depth: int,
+                          traversal: str, t: float, stats: AnonymizationStats = None,
+                          budget: Budget = None) -> List[np.ndarray]:
+        with phase(stats, "arrays"):
+            engine = self.__numpy_engine(traversal)
+        engine.stats = stats
+        engine.budget = budget
+        try:
+            with phase(stats, "partition"):
+                positions = engine.partition(k, l, n_jobs, parallel_rows, parallel_depth, t=t)
+        finally:
+            engine.stats = None
+            engine.budget = None
+        self.split_count = engine.split_count
+        self.failed_splits = engine.failed_splits
+        return positions
+
+    def build_tree(self, k: int = _DEFAULT_K, l: int = 0, n_jobs: int = 1, parallel_rows: int = None,
+                   parallel_depth: int = None, traversal: str = "bfs", t: float = None) -> PartitionTree:
+        # Partition and keep the split history. tree.partitions(k, l, t) gives partitions for any larger k,
+        # or another l or t, without running the algorithm again.
+        if self.engine == "pandas":
+            raise Exception("Partition tree requires numpy engine")
+        if traversal not in self.TRAVERSALS:
+            raise Exception("Unknown traversal " + str(traversal) + ", use one of: " + ", ".join(self.TRAVERSALS))
+        engine = self.__numpy_engine(traversal)
+        tree = engine.build_tree(k, l, n_jobs, parallel_rows, parallel_depth, t)
+        self.split_count = engine.split_count
+        self.failed_splits = engine.failed_splits
+        tree.index = self.index
+        return tree
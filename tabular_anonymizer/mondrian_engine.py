@@ -0,0 +1,606 @@
+import time
+from collections import deque
+from typing import List
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from pandas.api.types import is_extension_array_dtype, is_numeric_dtype
+
+from .budget import Budget
+from .numba_kernels import numba, partition_compiled
+from .partition_tree import PartitionTree
+from .stats import AnonymizationStats
+
+"""
+Mondrian partitioning over contiguous NumPy arrays.
+
+Feature columns are converted once to NumPy arrays (category codes for categorical columns) and partitions are
+represented as arrays of row positions. Produces the same partitions as the pandas implementation
+in MondrianAnonymizer, without the overhead of pandas indexing on every split.
+"""
+
+
+def earth_movers_distance(p: np.ndarray, q: np.ndarray, ordered: bool) -> float:
+    # Earth Mover's Distance between distributions p and q. For ordered values it is computed from the differences
+    # of the cumulative distributions, normalized by the number of values - 1. For unordered values
+    # (all values at equal distance) it is the total variation distance.
+    if ordered:
+        return float(np.abs(np.cumsum(p - q)).sum()) / max(np.count_nonzero(q) - 1, 1)
+    return 0.5 * float(np.abs(p - q).sum())
+
+
+def quantile_bins(values: np.ndarray, bins: int) -> (np.ndarray, np.ndarray, np.ndarray):
+    # Bins numeric values to at most bins quantile bins. Returns bin codes (0 for missing values, bins from 1 up)
+    # and the smallest and largest value of every bin indexed by code. Columns with at most bins distinct
+    # values get one bin per value, so binning does not change their splits.
+    present = ~np.isnan(values) if values.dtype.kind == "f" else np.ones(len(values), dtype=bool)
+    ordered = np.sort(values[present])
+    if len(ordered) == 0:
+        return np.zeros(len(values), dtype=np.uint8), np.full(1, np.nan), np.full(1, np.nan)
+    lower = np.unique(ordered)
+    if len(lower) > bins:
+        lower = np.unique(ordered[np.arange(bins) * len(ordered) // bins])
+    upper = np.append(ordered[np.searchsorted(ordered, lower[1:]) - 1], ordered[-1])
+    codes = np.searchsorted(lower, values, side="right")
+    codes[~present] = 0
+    nan = np.full(1, np.nan)
+    return (codes.astype(np.min_scalar_type(len(lower))), np.concatenate((nan, lower)),
+            np.concatenate((nan, upper)))
+
+
+class _Partition:
+    # Row positions of a partition in original row order. With presorting, also positions of the rows
+    # sorted by each numeric feature column (missing values left out), like in a k-d tree build.
+    # Bounds hold the bounding box of the partition: (min, max) of numeric columns and code histograms
+    # of categorical columns. Split column and value are those of the latest split of this partition.
+    # Node is the id of the partition in a recorded PartitionTree. Sensitive holds histograms of the
+    # sensitive column codes, None for columns with more distinct values than the partition has rows.
+    # Exhausted holds indexes of feature columns that are constant (or missing) in the partition, and so in
+    # the whole subtree below it. They can never be split.
+    __slots__ = ("rows", "order", "depth", "bounds", "split_column", "split_value", "node", "sensitive",
+                 "exhausted")
+
+    def __init__(self, rows: np.ndarray, order: list = None, depth: int = 0) -> None:
+        self.rows = rows
+        self.order = order
+        self.depth = depth
+        self.bounds = None
+        self.split_column = None
+        self.split_value = None
+        self.node = None
+        self.sensitive = None
+        self.exhausted = frozenset()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+class NumpyMondrianEngine:
+    feature_columns: List[str] = []     # Quasi-identifiers
+    sensitive_columns: List[str] = []   # Columns used for l-diversity
+    values: List[np.ndarray] = []       # Feature column values, category codes for categorical columns
+    categorical: List[bool] = []        # True if feature column is categorical
+    n_codes: List[int] = []             # Number of codes of categorical column, code 0 is missing value
+    categories: list = []               # Categories of categorical columns, None for numeric columns
+    has_nan: List[bool] = []            # True if numeric feature column contains missing values
+    # Approximate mode: numeric feature columns are binned to at most bins quantile bins, see quantile_bins().
+    # Bin codes are handled like category codes, splits are made on bin boundaries.
+    bins: int = None
+    binned: List[bool] = []             # True if numeric feature column is binned
+    bin_min: list = []                  # Smallest and largest value of each bin of binned columns, by bin code
+    bin_max: list = []
+    sensitive_codes: List[np.ndarray] = []  # Factorized sensitive columns, code 0 is missing value
+    n_sensitive_codes: List[int] = []   # Number of codes of sensitive columns
+    sensitive_ordered: List[bool] = []  # True if values of sensitive column are ordered (numeric or ordered category)
+    sensitive_distributions: List[np.ndarray] = []  # Distribution of sensitive values in the whole table
+    presort: bool = False   # Sort numeric columns once and carry sort orders down the partition tree
+    categorical_split: str = "appearance"   # Halve categories in order of appearance or in category "order"
+    traversal: str = "bfs"  # Process partitions breadth-first from a queue or depth-first ("dfs") from a stack
+    compiled: bool = False  # Partition with the Numba kernel when Numba is installed, see numba_kernels
+    max_split_count: int = 1000000  # failsafe that prevents algorithm to get stuck to infinite loop
+    split_count: int = 0
+    failed_splits: int = 0  # Split attempts rejected because a child would not be valid
+    depth: int = None       # Depth of the deepest finished partition
+    stats: AnonymizationStats = None    # Accumulates time of partitioning steps and tree depth when given
+    budget: Budget = None   # Stops refining partitions when time runs out or on cancellation, when given
+    n_rows: int = 0
+
+    # df may also be a dictionary of prepared columns, see MondrianAnonymizer.prepare_columns()
+    def __init__(self, df: DataFrame, feature_columns: List[str], sensitive_columns: List[str],
+                 max_split_count: int = 1000000, presort: bool = False,
+                 categorical_split: str = "appearance", traversal: str = "bfs", compiled: bool = False,
+                 bins: int = None) -> None:
+        self.feature_columns = feature_columns
+        self.sensitive_columns = sensitive_columns or []
+        self.max_split_count = max_split_count
+        self.presort = presort
+        self.categorical_split = categorical_split
+        self.traversal = traversal
+        self.compiled = compiled
+        self.bins = bins
+        self.split_count = 0
+        self.failed_splits = 0
+        self.depth = None
+        self.stats = None
+        self.budget = None
+        self.n_rows = len(df[feature_columns[0]])
+        self.values = []
+        self.categorical = []
+        self.n_codes = []
+        self.categories = []
+        self.has_nan = []
+        self.binned = []
+        self.bin_min = []
+        self.bin_max = []
+        for column in feature_columns:
+            series = df[column]
+            if series.dtype.name == "category":
+                n_codes = len(series.cat.categories) + 1
+                codes = series.cat.codes.to_numpy()
+                self.values.append((codes + 1).astype(np.min_scalar_type(n_codes - 1)))
+                self.categorical.append(True)
+                self.n_codes.append(n_codes)
+                self.categories.append(series.cat.categories)
+                self.has_nan.append(False)
+                self.binned.append(False)
+                self.bin_min.append(None)
+                self.bin_max.append(None)
+            else:
+                if is_extension_array_dtype(series.dtype):
+                    values = series.to_numpy(dtype="float64", na_value=np.nan)
+                else:
+                    values = np.ascontiguousarray(series.to_numpy())
+                self.categorical.append(False)
+                self.categories.append(None)
+                if bins is not None:
+                    codes, bin_min, bin_max = quantile_bins(values, bins)
+                    self.values.append(codes)
+                    self.n_codes.append(len(bin_min))
+                    self.has_nan.append(False)
+                    self.binned.append(True)
+                    self.bin_min.append(bin_min)
+                    self.bin_max.append(bin_max)
+                    continue
+                self.values.append(values)
+                self.n_codes.append(0)
+                self.has_nan.append(values.dtype.kind == "f" and bool(np.isnan(values).any()))
+                self.binned.append(False)
+                self.bin_min.append(None)
+                self.bin_max.append(None)
+        # Missing values get code 0 and count as one distinct value, like Series.unique().
+        # Codes are in the order of the values, which is needed for t-closeness of ordered values.
+        self.sensitive_codes = []
+        self.n_sensitive_codes = []
+        self.sensitive_ordered = []
+        self.sensitive_distributions = []
+        for column in self.sensitive_columns:
+            series = df[column]
+            codes, uniques = pd.factorize(series, sort=True)
+            n_codes = len(uniques) + 1
+            codes = (codes + 1).astype(np.min_scalar_type(n_codes - 1))
+            self.sensitive_codes.append(codes)
+            self.n_sensitive_codes.append(n_codes)
+            self.sensitive_ordered.append(series.cat.ordered if series.dtype.name == "category"
+                                          else is_numeric_dtype(series))
+            self.sensitive_distributions.append(np.bincount(codes, minlength=n_codes) / len(codes))
+        # Scratch array used to route sorted positions to the children of a split
+        self._side = np.empty(self.n_rows, dtype=np.int8) if presort else None
+
+    def root(self) -> _Partition:
+        rows = np.arange(self.n_rows)
+        if not self.presort:
+            return _Partition(rows)
+        order = []
+        for i, values in enumerate(self.values):
+            if self.categorical[i] or self.binned[i]:
+                order.append(None)
+                continue
+            o = np.argsort(values, kind="stable")
+            if self.has_nan[i]:
+                # argsort puts missing values last
+                o = o[: len(o) - int(np.isnan(values).sum())]
+            order.append(o)
+        return _Partition(rows, order)
+
+    def __numeric_bounds(self, i: int, partition: _Partition) -> tuple:
+        if partition.order is not None:
+            o = partition.order[i]
+            return (self.values[i][o[0]], self.values[i][o[-1]]) if len(o) else (np.nan, np.nan)
+        values = self.values[i][partition.rows]
+        if self.has_nan[i]:
+            values = values[~np.isnan(values)]
+            if len(values) == 0:
+                return np.nan, np.nan
+        return values.min(), values.max()
+
+    def __code_counts(self, i: int, rows: np.ndarray) -> np.ndarray:
+        return np.bincount(self.values[i][rows], minlength=self.n_codes[i])
+
+    def get_bounds(self, partition: _Partition) -> list:
+        # Full scan of all feature columns, only needed for the root. Children derive their bounds
+        # from the parent, see split_bounds().
+        if partition.bounds is None:
+            partition.bounds = [self.__code_counts(i, partition.rows) if self.categorical[i] or self.binned[i]
+                                else self.__numeric_bounds(i, partition)
+                                for i in range(len(self.feature_columns))]
+        return partition.bounds
+
+    def get_spans(self, partition: _Partition, scale: dict = None) -> dict:
+        spans = {}
+        for i, bounds in enumerate(self.get_bounds(partition)):
+            column = self.feature_columns[i]
+            if self.categorical[i]:
+                span = np.count_nonzero(bounds)
+            elif self.binned[i]:
+                present = np.flatnonzero(bounds[1:]) + 1
+                if len(present) == 0:
+                    span = np.nan
+                elif len(present) == 1:
+                    # Values within a bin cannot be split
+                    span = 0
+                else:
+                    span = self.bin_max[i][present[-1]] - self.bin_min[i][present[0]]
+            else:
+                span = bounds[1] - bounds[0]
+            if scale is not None and column in scale and scale[column] != 0:
+                span = span / scale[column]
+            spans[column] = span
+        return spans
+
+    def __median(self, i: int, partition: _Partition):
+        if partition.order is None:
+            values = self.values[i][partition.rows]
+            return np.nanmedian(values) if self.has_nan[i] else np.median(values)
+        o = partition.order[i]
+        m = len(o)
+        if m == 0:
+            return np.nan
+        # Middle element(s) of the sorted positions, averaged like np.median does
+        middle = o[m // 2 - 1: m // 2 + 1] if m % 2 == 0 else o[m // 2: m // 2 + 1]
+        return np.mean(self.values[i][middle])
+
+    def split(self, column: str, partition: _Partition, k: int = 0) -> (_Partition, _Partition):
+        # With k > 0, sizes of the children are counted first and None is returned without building
+        # the children if either of them would have fewer than k rows.
+        self.split_count += 1
+        if self.split_count > self.max_split_count:
+            raise Exception(
+                "Abort: Maximum amount of split operations exceeded: {max}. "
+                "Check your dataset and parameters.".format(max=self.max_split_count))
+        i = self.feature_columns.index(column)
+        rows = partition.rows
+        partition.split_column = i
+        if self.categorical[i]:
+            counts = self.get_bounds(partition)[i]
+            if self.categorical_split == "order":
+                # Present codes in category order, read from the code histogram
+                codes = np.flatnonzero(counts)
+                values = None
+            else:
+                # Distinct codes in order of appearance, like Categorical.unique()
+                values = self.values[i][rows]
+                codes = pd.unique(values)
+            partition.split_value = codes[: len(codes) // 2]
+            n_left = int(counts[partition.split_value].sum())
+            if k > 0 and (n_left < k or len(rows) - n_left < k):
+                return None
+            if values is None:
+                values = self.values[i][rows]
+            # Code -> side lookup, a split is a single gather
+            lookup = np.zeros(self.n_codes[i], dtype=bool)
+            lookup[partition.split_value] = True
+            left = lookup[values]
+            right = ~left
+        elif self.binned[i]:
+            # Median bin from the histogram: rows in lower bins go left, like values below the median
+            counts = self.get_bounds(partition)[i]
+            cumulative = np.cumsum(counts[1:])
+            n_present = int(cumulative[-1])
+            if n_present == 0:
+                partition.split_value = 1
+                return None if k > 0 else (_Partition(rows[:0], depth=partition.depth + 1),
+                                           _Partition(rows[:0], depth=partition.depth + 1))
+            b = int(np.searchsorted(cumulative, n_present // 2, side="right")) + 1
+            partition.split_value = b
+            n_left = int(cumulative[b - 2]) if b > 1 else 0
+            if k > 0 and (n_left < k or n_present - n_left < k):
+                return None
+            values = self.values[i][rows]
+            right = values >= b
+            left = ~right
+            if counts[0]:
+                left &= values > 0
+        else:
+            median = self.__median(i, partition)
+            partition.split_value = median
+            if k > 0 and partition.order is not None:
+                # Rank of the median in the sorted positions gives the sizes of the children
+                n_left = self.__rank(i, partition.order[i], median)
+                if n_left < k or len(partition.order[i]) - n_left < k:
+                    return None
+            values = self.values[i][rows]
+            left = values < median
+            right = values >= median
+            if k > 0 and partition.order is None:
+                n_left = np.count_nonzero(left)
+                if n_left < k or np.count_nonzero(right) < k:
+                    return None
+        # Sort orders of the children are only built for accepted splits, see split_orders()
+        depth = partition.depth + 1
+        return _Partition(rows[left], depth=depth), _Partition(rows[right], depth=depth)
+
+    def __rank(self, i: int, order: np.ndarray, value) -> int:
+        # Number of values below value, binary search over the sorted positions
+        values = self.values[i]
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if values[order[middle]] < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def split_orders(self, partition: _Partition, lp: _Partition, rp: _Partition) -> None:
+        # Stable partition of the parent's sorted positions keeps the children sorted
+        if partition.order is None:
+            return
+        side = self._side
+        side[partition.rows] = 2
+        side[lp.rows] = 0
+        side[rp.rows] = 1
+        lp.order = []
+        rp.order = []
+        for o in partition.order:
+            if o is None:
+                lp.order.append(None)
+                rp.order.append(None)
+                continue
+            s = side[o]
+            lp.order.append(o[s == 0])
+            rp.order.append(o[s == 1])
+
+    def split_bounds(self, partition: _Partition, lp: _Partition, rp: _Partition) -> None:
+        # Bounds of the children of an accepted split. Only columns whose bounds can change are scanned,
+        # and only over the rows of the child.
+        split_column = partition.split_column
+        small = lp if len(lp) <= len(rp) else rp
+        # Rows with missing value in a numeric split column end up in neither child
+        complete = len(lp) + len(rp) == len(partition)
+        lp.bounds = []
+        rp.bounds = []
+        for i, bounds in enumerate(partition.bounds):
+            if self.binned[i] and i == split_column:
+                # Lower bins went left, missing values to neither child
+                lb = bounds.copy()
+                lb[0] = 0
+                lb[partition.split_value:] = 0
+                rb = bounds.copy()
+                rb[:partition.split_value] = 0
+            elif self.categorical[i] or self.binned[i]:
+                if i == split_column:
+                    # Codes of the split column are known from the split itself
+                    left = np.zeros(len(bounds), dtype=bool)
+                    left[partition.split_value] = True
+                    lb = np.where(left, bounds, 0)
+                    rb = bounds - lb
+                elif np.count_nonzero(bounds) == 1:
+                    lb = np.where(bounds > 0, len(lp), 0)
+                    rb = np.where(bounds > 0, len(rp), 0)
+                elif complete:
+                    # Histogram of the larger child is the parent's minus the smaller child's
+                    sb = self.__code_counts(i, small.rows)
+                    lb, rb = (sb, bounds - sb) if small is lp else (bounds - sb, sb)
+                else:
+                    lb = self.__code_counts(i, lp.rows)
+                    rb = self.__code_counts(i, rp.rows)
+            elif (bounds[0] == bounds[1] and not self.has_nan[i]) or i in partition.exhausted:
+                lb = rb = bounds
+            elif i == split_column:
+                # Values below the median went left, so the outer bounds are the parent's
+                lb = (bounds[0], self.__numeric_bounds(i, lp)[1])
+                rb = (self.__numeric_bounds(i, rp)[0], bounds[1])
+            else:
+                lb = self.__numeric_bounds(i, lp)
+                rb = self.__numeric_bounds(i, rp)
+            lp.bounds.append(lb)
+            rp.bounds.append(rb)
+
+    def is_valid(self, partition: _Partition, k: int, l: int = 0, t: float = None) -> bool:
+        if len(partition) < k:
+            return False
+        if l > 0:
+            for codes in self.sensitive_codes:
+                if len(np.unique(codes[partition.rows])) < l:
+                    return False
+        if t is not None and self.closeness(partition.rows) > t:
+            return False
+        return True
+
+    def closeness(self, rows: np.ndarray) -> float:
+        # Largest distance between the distribution of a sensitive column in rows and in the whole table
+        return max((self.__distance(j, np.bincount(codes[rows], minlength=self.n_sensitive_codes[j]))
+                    for j, codes in enumerate(self.sensitive_codes)), default=0.0)
+
+    def __distance(self, j: int, counts: np.ndarray) -> float:
+        return earth_movers_distance(counts / counts.sum(), self.sensitive_distributions[j], self.sensitive_ordered[j])
+
+    def __sensitive_counts(self, j: int, rows: np.ndarray, keep: bool = False):
+        # Histogram is only kept if it is not larger than the partition, unless needed for t-closeness
+        if not keep and self.n_sensitive_codes[j] > len(rows):
+            return None
+        return np.bincount(self.sensitive_codes[j][rows], minlength=self.n_sensitive_codes[j])
+
+    def get_sensitive_counts(self, partition: _Partition, keep: bool = False) -> list:
+        if partition.sensitive is None or (keep and any(c is None for c in partition.sensitive)):
+            partition.sensitive = [self.__sensitive_counts(j, partition.rows, keep)
+                                   for j in range(len(self.sensitive_codes))]
+        return partition.sensitive
+
+    def is_valid_split(self, partition: _Partition, lp: _Partition, rp: _Partition, k: int, l: int = 0,
+                       t: float = None) -> bool:
+        # Validity of both children of a split. For l-diversity and t-closeness only the smaller child is counted,
+        # histogram of the larger child is the parent's minus the smaller child's. Histograms of accepted
+        # children are kept.
+        if len(lp) < k or len(rp) < k:
+            return False
+        if l <= 0 and t is None:
+            return True
+        keep = t is not None
+        small, large = (lp, rp) if len(lp) <= len(rp) else (rp, lp)
+        # Rows with missing value in a numeric split column end up in neither child
+        complete = len(lp) + len(rp) == len(partition)
+        small_counts = []
+        large_counts = []
+        for j, counts in enumerate(self.get_sensitive_counts(partition, keep)):
+            if counts is None:
+                sc = lc = None
+                if len(np.unique(self.sensitive_codes[j][small.rows])) < l or \
+                        len(np.unique(self.sensitive_codes[j][large.rows])) < l:
+                    return False
+            else:
+                sc = np.bincount(self.sensitive_codes[j][small.rows], minlength=len(counts))
+                if np.count_nonzero(sc) < l or (keep and self.__distance(j, sc) > t):
+                    return False
+                # Counted in full when rows are missing, also if it is not kept afterwards
+                lc = counts - sc if complete else self.__sensitive_counts(j, large.rows, keep=True)
+                if np.count_nonzero(lc) < l or (keep and self.__distance(j, lc) > t):
+                    return False
+                if not keep and self.n_sensitive_codes[j] > len(small):
+                    sc = None
+                if not keep and lc is not None and self.n_sensitive_codes[j] > len(large):
+                    lc = None
+            small_counts.append(sc)
+            large_counts.append(lc)
+        small.sensitive = small_counts
+        large.sensitive = large_counts
+        return True
+
+    def split_label(self, partition: _Partition):
+        # Split value of the latest split in terms of the data: median or categories going left
+        i = partition.split_column
+        if self.binned[i]:
+            # Rows below the smallest value of the median bin went left
+            return self.bin_min[i][partition.split_value]
+        if not self.categorical[i]:
+            return partition.split_value
+        categories = self.categories[i]
+        return [categories[c - 1] if c > 0 else np.nan for c in partition.split_value]
+
+    def partition(self, k: int, l: int = 0, n_jobs: int = 1, parallel_rows: int = None,
+                  parallel_depth: int = None, tree: PartitionTree = None, t: float = None) -> List[np.ndarray]:
+        if n_jobs != 1:
+            from .parallel import partition_parallel
+            return partition_parallel(self, k, l, n_jobs, parallel_rows, parallel_depth, tree, t)
+        # Compiled kernel does not record trees, check t-closeness, use bins or stop early
+        if self.compiled and numba is not None and tree is None and t is None and k >= 1 and self.bins is None \
+                and self.budget is None:
+            return partition_compiled(self, k, l)
+        root = self.root()
+        return self.partition_subtree(root, self.get_spans(root), k, l, tree=tree, t=t)
+
+    def build_tree(self, k: int, l: int = 0, n_jobs: int = 1, parallel_rows: int = None,
+                   parallel_depth: int = None, t: float = None) -> PartitionTree:
+        tree = PartitionTree(sensitive_codes=self.sensitive_codes, k=k, l=l, t=t, closeness=self.closeness)
+        self.partition(k, l, n_jobs, parallel_rows, parallel_depth, tree, t)
+        return tree
+
+    def partition_subtree(self, root: _Partition, scale: dict, k: int, l: int = 0, offload=None,
+                          tree: PartitionTree = None, t: float = None) -> list:
+        # offload(partition) may take over a whole subtree and return a placeholder for its partitions.
+        # If tree is given, splits and leaves are recorded to it.
+        if tree is not None and root.node is None:
+            root.node = tree.add_node(len(root))
+        finished_partitions = []
+        partitions = deque([root])
+        dfs = self.traversal == "dfs"
+        pop = partitions.pop if dfs else partitions.popleft
+        stats = self.stats
+        budget = self.budget
+        clock = time.perf_counter
+        while partitions:
+            partition = pop()
+            if budget is not None and budget.exhausted():
+                # Out of time or cancelled, pending partitions came from valid splits and are kept as they are
+                self.finish(partition, finished_partitions, tree)
+                continue
+            if offload is not None:
+                placeholder = offload(partition)
+                if placeholder is not None:
+                    finished_partitions.append(placeholder)
+                    continue
+            if k >= 1 and len(partition) < 2 * k:
+                # No split can give two children of k rows
+                self.finish(partition, finished_partitions, tree)
+                continue
+            if stats is not None:
+                start = clock()
+            spans = self.get_spans(partition, scale)
+            if stats is not None:
+                stats.add_time("spans", clock() - start)
+            if k >= 1:
+                # Constant and missing columns stay so in the subtree, splitting them gives an empty child.
+                # A categorical span is its number of codes, a constant categorical column has span 1.
+                bounds = self.get_bounds(partition)
+                partition.exhausted = partition.exhausted.union(
+                    i for i, column in enumerate(self.feature_columns)
+                    if i not in partition.exhausted and (not spans[column] > 0 or
+                                                         (self.categorical[i] and np.count_nonzero(bounds[i]) <= 1)))
+            # All columns are sorted, like the pandas engine does, so that NaN spans of all-missing columns leave
+            # the other columns in the same order. Exhausted columns are skipped afterwards.
+            sorted_items = sorted(spans.items(), key=lambda x: -x[1])
+            for column, span in sorted_items:
+                if k >= 1 and self.feature_columns.index(column) in partition.exhausted:
+                    continue
+                if stats is not None:
+                    start = clock()
+                children = self.split(column, partition, k)
+                if stats is not None:
+                    split_time = clock()
+                    stats.add_time("split", split_time - start)
+                valid = children is not None and self.is_valid_split(partition, children[0], children[1], k, l, t)
+                if stats is not None:
+                    stats.add_time("validity", clock() - split_time)
+                if not valid:
+                    self.failed_splits += 1
+                    continue
+                lp, rp = children
+                lp.exhausted = rp.exhausted = partition.exhausted
+                if stats is not None:
+                    start = clock()
+                self.split_orders(partition, lp, rp)
+                self.split_bounds(partition, lp, rp)
+                if stats is not None:
+                    stats.add_time("bounds", clock() - start)
+                if budget is not None:
+                    # Rows with missing value in a numeric split column are left out
+                    budget.add(len(partition) - len(lp) - len(rp))
+                if tree is not None:
+                    dropped = None
+                    if len(lp) + len(rp) < len(partition):
+                        dropped = np.setdiff1d(partition.rows, np.concatenate((lp.rows, rp.rows)))
+                    lp.node, rp.node = tree.add_split(partition.node, column, self.split_label(partition),
+                                                      len(lp), len(rp), dropped)
+                # Left partition is processed first in both traversals
+                partitions.extend((rp, lp) if dfs else (lp, rp))
+                break
+            else:
+                self.finish(partition, finished_partitions, tree)
+        return finished_partitions
+
+    def finish(self, partition: _Partition, finished_partitions: list, tree: PartitionTree = None) -> None:
+        if tree is not None:
+            tree.add_leaf(partition.node, partition.rows)
+        self.add_depth(partition.depth)
+        if self.budget is not None:
+            self.budget.add(len(partition))
+        finished_partitions.append(partition.rows)
+
+    def add_depth(self, depth: int) -> None:
+        # Also for subtrees finished by the compiled kernel or in worker processes
+        if depth is None:
+            return
+        self.depth = max(self.depth or 0, depth)
+        if self.stats is not None:
+            self.stats.depth = max(self.stats.depth or 0, depth)
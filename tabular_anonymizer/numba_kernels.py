@@ -0,0 +1,275 @@
+from typing import List
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+"""
+Mondrian partitioning compiled with Numba. The whole partitioning loop runs in nopython code over a float64 matrix
+of feature columns (category codes for categorical columns) and an int64 matrix of sensitive column codes.
+Partitions are segments of a single array of row positions, which is partitioned in place on every accepted split.
+Produces the same partitions as NumpyMondrianEngine. Without Numba the engine uses its NumPy implementation.
+"""
+
+
+def _jit(function):
+    # Compiled in nopython mode when Numba is installed, otherwise left as plain Python
+    if numba is None:
+        return function
+    return numba.njit(cache=True, nogil=True)(function)
+
+
+@_jit
+def _spans(values, categorical, rows, start, end, marks, stamp, spans):
+    # Span of every feature column over rows[start:end]: number of distinct codes of categorical columns,
+    # max - min of numeric columns (NaN if all values are missing). Returns the latest stamp used in marks.
+    n_features = values.shape[0]
+    for i in range(n_features):
+        if categorical[i]:
+            stamp += 1
+            count = 0
+            for p in range(start, end):
+                c = np.int64(values[i, rows[p]])
+                if marks[c] != stamp:
+                    marks[c] = stamp
+                    count += 1
+            spans[i] = count
+        else:
+            low = np.inf
+            high = -np.inf
+            seen = False
+            for p in range(start, end):
+                v = values[i, rows[p]]
+                if v == v:
+                    seen = True
+                    if v < low:
+                        low = v
+                    if v > high:
+                        high = v
+            spans[i] = high - low if seen else np.nan
+    return stamp
+
+
+@_jit
+def _distinct(codes, rows, side, start, end, which, marks, stamp):
+    # Number of distinct codes among rows of segment whose side is which
+    count = 0
+    for p in range(start, end):
+        if side[p - start] == which:
+            c = codes[rows[p]]
+            if marks[c] != stamp:
+                marks[c] = stamp
+                count += 1
+    return count
+
+
+@_jit
+def _sort_order(keys):
+    # Order in which Python's sorted() puts keys, also with NaN keys, which compare False to everything. For
+    # fewer than 64 keys list.sort() is a binary insertion sort after its first run, which is repeated here.
+    # Larger arrays are sorted stably, which is the same for keys without NaN.
+    n = len(keys)
+    order = np.arange(n)
+    if n >= 64:
+        return np.argsort(keys, kind="mergesort")
+    if n < 2:
+        return order
+    # Length of the first run, a strictly descending run is reversed
+    run = 2
+    if keys[1] < keys[0]:
+        while run < n and keys[order[run]] < keys[order[run - 1]]:
+            run += 1
+        order[:run] = order[:run][::-1].copy()
+    else:
+        while run < n and not keys[order[run]] < keys[order[run - 1]]:
+            run += 1
+    for start in range(run, n):
+        pivot = order[start]
+        low = 0
+        high = start
+        while low < high:
+            middle = low + ((high - low) >> 1)
+            if keys[pivot] < keys[order[middle]]:
+                high = middle
+            else:
+                low = middle + 1
+        for q in range(start, low, -1):
+            order[q] = order[q - 1]
+        order[low] = pivot
+    return order
+
+
+@_jit
+def partition_kernel(values, categorical, sensitive, k, l, order_split, dfs, max_split_count, n_codes):
+    # Returns row positions and start and end of every partition in them, in the order partitions were finished,
+    # the number of split attempts and of failed ones, and the depth of the deepest partition. Number of partitions
+    # is -1 if max_split_count was exceeded.
+    n_features, n_rows = values.shape
+    rows = np.arange(n_rows)
+    scratch = np.empty(n_rows, dtype=np.int64)
+    side = np.empty(n_rows, dtype=np.int8)
+    buffer = np.empty(n_rows, dtype=np.float64)
+    marks = np.full(n_codes, -1, dtype=np.int64)
+    codes = np.empty(n_codes, dtype=np.int64)
+    spans = np.empty(n_features, dtype=np.float64)
+    skip = np.empty(n_features, dtype=np.bool_)
+    scale = np.empty(n_features, dtype=np.float64)
+    stamp = 0
+    # Every pushed partition has at least k >= 1 rows, so there are fewer than 2 * n_rows of them
+    starts = np.empty(2 * n_rows + 1, dtype=np.int64)
+    ends = np.empty(2 * n_rows + 1, dtype=np.int64)
+    depths = np.empty(2 * n_rows + 1, dtype=np.int64)
+    leaf_starts = np.empty(n_rows + 1, dtype=np.int64)
+    leaf_ends = np.empty(n_rows + 1, dtype=np.int64)
+    n_leaves = 0
+    split_count = 0
+    failed_splits = 0
+    max_depth = 0
+
+    stamp = _spans(values, categorical, rows, 0, n_rows, marks, stamp, scale)
+    starts[0] = 0
+    ends[0] = n_rows
+    depths[0] = 0
+    head = 0
+    tail = 1
+    while tail > head:
+        if dfs:
+            tail -= 1
+            start = starts[tail]
+            end = ends[tail]
+            depth = depths[tail]
+        else:
+            start = starts[head]
+            end = ends[head]
+            depth = depths[head]
+            head += 1
+        if end - start < 2 * k:
+            # No split can give two children of k rows
+            leaf_starts[n_leaves] = start
+            leaf_ends[n_leaves] = end
+            n_leaves += 1
+            max_depth = max(max_depth, depth)
+            continue
+        stamp = _spans(values, categorical, rows, start, end, marks, stamp, spans)
+        for i in range(n_features):
+            # Constant or missing column, splitting it gives an empty child. Span of a categorical column is its
+            # number of codes, a single code cannot be split.
+            skip[i] = not spans[i] > 0 or (categorical[i] and spans[i] <= 1)
+            if scale[i] != 0:
+                spans[i] = spans[i] / scale[i]
+        split = False
+        # Columns are tried in the order of the NumPy engine, which sorts spans with sorted()
+        for i in _sort_order(-spans):
+            if skip[i]:
+                continue
+            split_count += 1
+            if split_count > max_split_count:
+                return rows, leaf_starts[:0], leaf_ends[:0], split_count, failed_splits, -1, max_depth
+            # Side of every row of the segment: 0 left, 1 right, 2 neither (missing value in numeric column)
+            if categorical[i]:
+                stamp += 1
+                n = 0
+                for p in range(start, end):
+                    c = np.int64(values[i, rows[p]])
+                    if marks[c] != stamp:
+                        marks[c] = stamp
+                        codes[n] = c
+                        n += 1
+                if order_split:
+                    codes[:n] = np.sort(codes[:n])
+                stamp += 1
+                for q in range(n // 2):
+                    marks[codes[q]] = stamp
+                for p in range(start, end):
+                    side[p - start] = 0 if marks[np.int64(values[i, rows[p]])] == stamp else 1
+            else:
+                m = 0
+                for p in range(start, end):
+                    v = values[i, rows[p]]
+                    if v == v:
+                        buffer[m] = v
+                        m += 1
+                median = np.median(buffer[:m]) if m > 0 else np.nan
+                for p in range(start, end):
+                    v = values[i, rows[p]]
+                    side[p - start] = 0 if v < median else (1 if v >= median else 2)
+            n_left = 0
+            n_right = 0
+            for p in range(end - start):
+                if side[p] == 0:
+                    n_left += 1
+                elif side[p] == 1:
+                    n_right += 1
+            if n_left < k or n_right < k:
+                failed_splits += 1
+                continue
+            diverse = True
+            if l > 0:
+                for j in range(sensitive.shape[0]):
+                    for which in range(2):
+                        stamp += 1
+                        if _distinct(sensitive[j], rows, side, start, end, which, marks, stamp) < l:
+                            diverse = False
+                            break
+                    if not diverse:
+                        break
+            if not diverse:
+                failed_splits += 1
+                continue
+            # Stable partition of the segment: left rows, right rows, then rows that went to neither child
+            q = 0
+            for which in range(3):
+                for p in range(start, end):
+                    if side[p - start] == which:
+                        scratch[q] = rows[p]
+                        q += 1
+            rows[start:end] = scratch[:end - start]
+            # Left partition is processed first in both traversals
+            if dfs:
+                starts[tail] = start + n_left
+                ends[tail] = start + n_left + n_right
+                starts[tail + 1] = start
+                ends[tail + 1] = start + n_left
+            else:
+                starts[tail] = start
+                ends[tail] = start + n_left
+                starts[tail + 1] = start + n_left
+                ends[tail + 1] = start + n_left + n_right
+            depths[tail] = depth + 1
+            depths[tail + 1] = depth + 1
+            tail += 2
+            split = True
+            break
+        if not split:
+            leaf_starts[n_leaves] = start
+            leaf_ends[n_leaves] = end
+            n_leaves += 1
+            max_depth = max(max_depth, depth)
+    return rows, leaf_starts[:n_leaves], leaf_ends[:n_leaves], split_count, failed_splits, n_leaves, max_depth
+
+
+def partition_compiled(engine, k: int, l: int = 0) -> List[np.ndarray]:
+    # Partitions of a NumpyMondrianEngine computed by the compiled kernel
+    n_rows = engine.n_rows
+    values = np.empty((len(engine.values), n_rows), dtype=np.float64)
+    for i, column in enumerate(engine.values):
+        values[i] = column
+    sensitive = np.empty((len(engine.sensitive_codes), n_rows), dtype=np.int64)
+    for j, codes in enumerate(engine.sensitive_codes):
+        sensitive[j] = codes
+    categorical = np.array(engine.categorical, dtype=np.bool_)
+    n_codes = max(engine.n_codes + engine.n_sensitive_codes + [1])
+    rows, starts, ends, split_count, failed_splits, n_leaves, depth = partition_kernel(
+        values, categorical, sensitive, k, l, engine.categorical_split == "order", engine.traversal == "dfs",
+        engine.max_split_count, n_codes)
+    engine.split_count = split_count
+    engine.failed_splits = failed_splits
+    if n_leaves < 0:
+        raise Exception(
+            "Abort: Maximum amount of split operations exceeded: {max}. "
+            "Check your dataset and parameters.".format(max=engine.max_split_count))
+    engine.add_depth(int(depth))
+    return [rows[s:e] for s, e in zip(starts, ends)]
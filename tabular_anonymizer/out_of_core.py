@@ -0,0 +1,222 @@
+import math
+import os
+import pickle
+import shutil
+import tempfile
+from collections import deque
+from typing import Iterator, List
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from .dataframe_anonymizer import DataFrameAnonymizer
+from .mondrian_anonymizer import MondrianAnonymizer
+from .partition_tree import PartitionTree
+
+"""
+Out-of-core Mondrian for tables larger than memory.
+
+Input is read in chunks from CSV or Parquet files. The top levels of splits are chosen by running Mondrian on a random
+sample of the rows. All rows are then routed through these splits and spilled to on-disk buckets, one per leaf.
+Buckets that are too small to satisfy k and l are merged with their siblings, and every bucket is finally
+anonymized in memory with the regular algorithm.
+"""
+
+
+def read_chunks(source, columns: List[str] = None, chunk_rows: int = 500000, **read_options) -> Iterator[DataFrame]:
+    # Reads CSV or Parquet file, or list of files, in chunks of at most chunk_rows rows.
+    # Parquet is detected from .parquet/.pq extension and requires pyarrow.
+    sources = source if isinstance(source, (list, tuple)) else [source]
+    for path in sources:
+        if str(path).endswith((".parquet", ".pq")):
+            try:
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise Exception("Reading Parquet files requires pyarrow")
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+                yield batch.to_pandas()
+        else:
+            yield from pd.read_csv(path, usecols=columns, chunksize=chunk_rows, **read_options)
+
+
+class OutOfCoreAnonymizer:
+    chunk_rows: int = 500000        # Rows read from the input at a time
+    bucket_rows: int = 1000000      # Target size of buckets that are anonymized in memory
+    sample_rows: int = 500000       # Rows sampled for choosing the top-level splits
+    work_dir: str = None            # Directory for bucket files, system temp directory by default
+    random_state: int = 0
+    anonymizer: DataFrameAnonymizer     # anonymizes each bucket in memory
+
+    # Other keyword arguments (engine, presort, ...) are passed to DataFrameAnonymizer
+    def __init__(self, sensitive_attribute_columns: List[str], feature_columns=None, avg_columns=None,
+                 format_to_str=False, chunk_rows=500000, bucket_rows=1000000, sample_rows=500000, work_dir=None,
+                 random_state=0, read_options: dict = None, **options):
+        self.anonymizer = DataFrameAnonymizer(sensitive_attribute_columns, feature_columns=feature_columns,
+                                              avg_columns=avg_columns, format_to_str=format_to_str, **options)
+        self.chunk_rows = chunk_rows
+        self.bucket_rows = bucket_rows
+        self.sample_rows = sample_rows
+        self.work_dir = work_dir
+        self.random_state = random_state
+        self.read_options = read_options or {}
+
+    def read(self, source) -> Iterator[DataFrame]:
+        # Chunks get a running index, so that index labels are unique over the whole input
+        offset = 0
+        for chunk in read_chunks(source, self.__columns(), self.chunk_rows, **self.read_options):
+            chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+            offset += len(chunk)
+            yield chunk
+
+    def __columns(self) -> List[str]:
+        a = self.anonymizer
+        if not a.feature_columns:
+            return None
+        columns = list(a.feature_columns) + list(a.sensitive_attribute_columns) + list(a.avg_columns or [])
+        return list(dict.fromkeys(columns))
+
+    def sample(self, source) -> (DataFrame, int):
+        # Uniform random sample of sample_rows rows: every row gets a random priority and the rows with
+        # the smallest priorities are kept
+        rng = np.random.default_rng(self.random_state)
+        sample = None
+        priorities = None
+        n_rows = 0
+        for chunk in self.read(source):
+            n_rows += len(chunk)
+            p = rng.random(len(chunk))
+            if sample is None:
+                sample, priorities = chunk, p
+            else:
+                sample, priorities = pd.concat([sample, chunk]), np.concatenate((priorities, p))
+            if len(sample) > self.sample_rows:
+                keep = np.argpartition(priorities, self.sample_rows)[:self.sample_rows]
+                keep.sort()
+                sample, priorities = sample.iloc[keep], priorities[keep]
+        if sample is None:
+            raise Exception("Input is empty")
+        return sample, n_rows
+
+    def build_tree(self, sample: DataFrame, n_rows: int) -> PartitionTree:
+        # Splits of the sample that give leaves of about bucket_rows rows in the whole input.
+        # Mondrian leaves have k to 2k rows, so k of the sample is half of the bucket size scaled to the sample.
+        a = self.anonymizer
+        k = math.ceil(self.bucket_rows * len(sample) / n_rows / 2)
+        if n_rows <= self.bucket_rows or k >= len(sample):
+            tree = PartitionTree()
+            tree.add_node(len(sample))
+            return tree
+        mondrian = MondrianAnonymizer(sample, a.feature_columns, a.sensitive_attribute_columns, copy=False,
+                                      categorical_split=a.categorical_split)
+        return mondrian.build_tree(k)
+
+    def spill(self, source, tree: PartitionTree, directory: str, l: int) -> (dict, dict):
+        # Routes all rows to the leaves of the tree and appends them to a bucket file of the leaf.
+        # Returns number of rows and (up to l) distinct sensitive values of each leaf.
+        sensitive_columns = self.anonymizer.sensitive_attribute_columns
+        counts = {}
+        distinct = {}
+        for chunk in self.read(source):
+            nodes = tree.route(chunk)
+            for node, rows in chunk.groupby(nodes, sort=False).indices.items():
+                piece = chunk.iloc[rows]
+                with open(self.__bucket_path(directory, node), "ab") as f:
+                    pickle.dump(piece, f, protocol=pickle.HIGHEST_PROTOCOL)
+                counts[node] = counts.get(node, 0) + len(piece)
+                if l > 0:
+                    values = distinct.setdefault(node, [set() for _ in sensitive_columns])
+                    for j, column in enumerate(sensitive_columns):
+                        if len(values[j]) < l:
+                            values[j].update(piece[column].unique()[:l])
+        return counts, distinct
+
+    @staticmethod
+    def __bucket_path(directory: str, node: int) -> str:
+        return os.path.join(directory, "bucket_{node}.pkl".format(node=node))
+
+    def read_bucket(self, directory: str, node: int) -> List[DataFrame]:
+        pieces = []
+        path = self.__bucket_path(directory, node)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                while True:
+                    try:
+                        pieces.append(pickle.load(f))
+                    except EOFError:
+                        break
+        return pieces
+
+    @staticmethod
+    def merge_buckets(tree: PartitionTree, counts: dict, distinct: dict, k: int, l: int) -> List[List[int]]:
+        # Groups of leaves that satisfy k and l in the whole input. A split of the sample is kept only if
+        # both children are valid, otherwise all leaves under the node form one group.
+        n_nodes = len(tree)
+        sizes = [0] * n_nodes
+        values = [None] * n_nodes
+        n_sensitive = len(next(iter(distinct.values()))) if distinct else 0
+        # Children always have larger ids than their parent
+        for node in range(n_nodes - 1, -1, -1):
+            if tree.is_leaf(node):
+                sizes[node] = counts.get(node, 0)
+                values[node] = distinct.get(node, [set() for _ in range(n_sensitive)])
+            else:
+                left, right = tree.left[node], tree.right[node]
+                sizes[node] = sizes[left] + sizes[right]
+                values[node] = [set(list(a | b)[:max(l, 0)]) for a, b in zip(values[left], values[right])]
+
+        def is_valid(node):
+            return sizes[node] >= k and all(len(v) >= l for v in values[node])
+
+        def leaves(node):
+            stack, result = [node], []
+            while stack:
+                n = stack.pop()
+                if tree.is_leaf(n):
+                    result.append(n)
+                else:
+                    stack.extend((tree.right[n], tree.left[n]))
+            return result
+
+        groups = []
+        queue = deque([0])
+        while queue:
+            node = queue.popleft()
+            left, right = tree.left[node], tree.right[node]
+            if left >= 0 and is_valid(left) and is_valid(right):
+                queue.extend((left, right))
+            else:
+                groups.append(leaves(node))
+        return groups
+
+    def anonymize(self, source, k, l=0, output: str = None):
+        # Anonymizes CSV or Parquet file(s) in source. Returns the anonymized dataframe, or writes it to
+        # CSV file output bucket by bucket and returns None.
+        a = self.anonymizer
+        if not a.sensitive_attribute_columns:
+            raise Exception("Provide at least one sensitive attribute column")
+        sample, n_rows = self.sample(source)
+        if not a.feature_columns:
+            a.init_feature_colums(sample)
+        tree = self.build_tree(sample, n_rows)
+        del sample
+        directory = tempfile.mkdtemp(prefix="tabular_anonymizer_", dir=self.work_dir)
+        try:
+            counts, distinct = self.spill(source, tree, directory, l)
+            results = []
+            header = True
+            for group in self.merge_buckets(tree, counts, distinct, k, l):
+                pieces = [piece for node in group for piece in self.read_bucket(directory, node)]
+                if not pieces:
+                    continue
+                dfa = a.anonymize(pd.concat(pieces), k, l)
+                if output is None:
+                    results.append(dfa)
+                else:
+                    dfa.to_csv(output, mode="w" if header else "a", header=header, index=False)
+                    header = False
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        if output is None:
+            return pd.concat(results, ignore_index=True)
+        return None
@@ -0,0 +1,133 @@
+import queue
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from pandas.api.types import is_categorical_dtype
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+"""
+Streaming output. Anonymized batches are written to a CSV or Parquet file in a background thread, so that writing
+overlaps with building the next batch. Every batch is a CSV chunk or a Parquet row group, and at most queue_size
+batches wait to be written, so memory does not grow with the size of the output.
+"""
+
+FORMATS = ("csv", "parquet")
+PARQUET_SUFFIXES = (".parquet", ".pq")
+
+
+def output_format(path, format: str = None) -> str:
+    # Format from the file suffix when not given, CSV by default
+    if format is None:
+        return "parquet" if str(path).lower().endswith(PARQUET_SUFFIXES) else "csv"
+    if format not in FORMATS:
+        raise Exception("Unknown format " + str(format) + ", use one of: " + ", ".join(FORMATS))
+    return format
+
+
+def plain_columns(frame: DataFrame, parquet: bool) -> DataFrame:
+    # Sets of values (categories of native outputs) as sorted lists of strings. Other categorical columns are
+    # written to Parquet as values, their dictionaries differ from batch to batch.
+    columns = {}
+    for name in frame.columns:
+        series = frame[name]
+        if is_categorical_dtype(series):
+            categories = series.cat.categories
+            if len(categories) and isinstance(categories[0], frozenset):
+                lists = np.empty(len(categories) + 1, dtype=object)
+                lists[:-1] = [sorted(str(v) for v in s) for s in categories]
+                lists[-1] = None
+                series = pd.Series(lists[series.cat.codes.to_numpy()], index=series.index, name=name)
+            elif parquet:
+                series = pd.Series(np.asarray(series), index=series.index, name=name)
+        columns[name] = series
+    return DataFrame(columns, index=frame.index)
+
+
+class BatchWriter:
+    path: str = None
+    format: str = "csv"
+    options: dict = {}      # Passed to DataFrame.to_csv() or pyarrow.parquet.ParquetWriter
+    rows: int = 0           # Rows written
+    seconds: float = 0.0    # Time spent writing in the background thread
+
+    def __init__(self, path, format: str = None, queue_size: int = 2, **options) -> None:
+        self.format = output_format(path, format)
+        if self.format == "parquet" and pa is None:
+            raise Exception("Writing Parquet output requires pyarrow")
+        self.path = path
+        self.options = options
+        self.rows = 0
+        self.seconds = 0.0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self.__run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.close()
+
+    def write(self, frame: DataFrame) -> None:
+        # Blocks while queue_size batches are waiting
+        self.__raise()
+        self._queue.put(frame)
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self.__raise()
+
+    def __raise(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def __run(self) -> None:
+        handle = None
+        writer = None
+        schema = None
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                break
+            if self._error is not None:
+                # Batches after an error are dropped, the error is raised by write() or close()
+                continue
+            try:
+                start = time.perf_counter()
+                frame = plain_columns(frame, self.format == "parquet")
+                if self.format == "csv":
+                    if handle is None:
+                        handle = open(self.path, "w", newline="")
+                    frame.to_csv(handle, header=self.rows == 0, index=False, **self.options)
+                else:
+                    table = pa.Table.from_pandas(frame, preserve_index=False)
+                    if writer is None:
+                        schema = table.schema
+                        writer = pq.ParquetWriter(self.path, schema, **self.options)
+                    elif not table.schema.equals(schema):
+                        table = table.cast(schema)
+                    writer.write_table(table, row_group_size=max(len(table), 1))
+                self.rows += len(frame)
+                self.seconds += time.perf_counter() - start
+            except Exception as e:
+                self._error = e
+        try:
+            if handle is not None:
+                handle.close()
+            if writer is not None:
+                writer.close()
+        except Exception as e:
+            self._error = self._error or e
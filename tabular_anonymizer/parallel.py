@@ -0,0 +1,136 @@
+import copy
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from typing import List
+
+import numpy as np
+
+from .partition_tree import PartitionTree
+
+"""
+Parallel Mondrian partitioning. After a split the two halves are independent, so subtrees are handed
+to a process pool. Feature and sensitive columns are placed in shared memory once and attached by the
+workers instead of being pickled for every task.
+"""
+
+
+class SharedArray:
+    # Picklable handle to a NumPy array copied into shared memory
+    name: str = None
+    shape: tuple = ()
+    dtype: str = None
+
+    def __init__(self, array: np.ndarray) -> None:
+        self._shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.name = self._shm.name
+        self.shape = array.shape
+        self.dtype = array.dtype.str
+        np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)[...] = array
+
+    def __getstate__(self) -> dict:
+        return {"name": self.name, "shape": self.shape, "dtype": self.dtype}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._shm = None
+
+    def attach(self) -> np.ndarray:
+        if self._shm is None:
+            self._shm = shared_memory.SharedMemory(name=self.name)
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+
+    def release(self) -> None:
+        self._shm.close()
+        self._shm.unlink()
+
+
+_worker_engine = None   # engine of a worker process, columns attached from shared memory
+_worker_shared = []     # handles must stay alive as long as the attached arrays are used
+
+
+def _init_worker(engine) -> None:
+    global _worker_engine, _worker_shared
+    _worker_shared = engine.values + engine.sensitive_codes
+    engine.values = [a.attach() for a in engine.values]
+    engine.sensitive_codes = [a.attach() for a in engine.sensitive_codes]
+    if engine.presort:
+        engine._side = np.empty(engine.n_rows, dtype=np.int8)
+    _worker_engine = engine
+
+
+def _partition_subtree(partition, scale: dict, k: int, l: int, t: float,
+                       record_tree: bool) -> (list, int, int, int, PartitionTree, str):
+    _worker_engine.split_count = 0
+    _worker_engine.failed_splits = 0
+    _worker_engine.depth = None
+    # Subtree is recorded to a tree of its own and grafted to the main tree afterwards
+    tree = PartitionTree() if record_tree else None
+    partition.node = None
+    partitions = _worker_engine.partition_subtree(partition, scale, k, l, tree=tree, t=t)
+    budget = _worker_engine.budget
+    return partitions, _worker_engine.split_count, _worker_engine.failed_splits, _worker_engine.depth, tree, \
+        None if budget is None else budget.stopped
+
+
+def partition_parallel(engine, k: int, l: int = 0, n_jobs: int = -1, parallel_rows: int = None,
+                       parallel_depth: int = None, tree: PartitionTree = None, t: float = None) -> List[np.ndarray]:
+    # Subtrees with at most parallel_rows rows, or at parallel_depth, are partitioned in worker processes.
+    # Partitions are returned in a deterministic order: the order in which the subtrees were handed out.
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
+    if parallel_rows is None and parallel_depth is None:
+        parallel_rows = max(engine.n_rows // (n_jobs * 4), 1)
+
+    context = multiprocessing.get_context()
+    budget = engine.budget
+    # Set when the main process sees the budget run out or cancellation, so that workers stop refining too
+    stop = context.Event() if budget is not None else None
+    shared = [SharedArray(a) for a in engine.values + engine.sensitive_codes]
+    template = copy.copy(engine)
+    template.values = shared[:len(engine.values)]
+    template.sensitive_codes = shared[len(engine.values):]
+    template._side = None
+    # Stats, progress and cancellation stay in the main process
+    template.stats = None
+    template.budget = budget.worker_budget(stop) if budget is not None else None
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=context, initializer=_init_worker,
+                                 initargs=(template,)) as pool:
+            root = engine.root()
+            scale = engine.get_spans(root)
+
+            def offload(partition):
+                if (parallel_rows is not None and len(partition) <= parallel_rows) or \
+                        (parallel_depth is not None and partition.depth >= parallel_depth):
+                    future = pool.submit(_partition_subtree, partition, scale, k, l, t, tree is not None)
+                    future.node = partition.node
+                    future.rows = len(partition)
+                    return future
+                return None
+
+            results = engine.partition_subtree(root, scale, k, l, offload=offload, tree=tree, t=t)
+            partitions = []
+            for result in results:
+                if isinstance(result, Future):
+                    while budget is not None and not result.done():
+                        if budget.exhausted():
+                            stop.set()
+                        wait([result], timeout=min(budget.interval, 0.1))
+                    subtree_partitions, split_count, failed_splits, depth, subtree, stopped = result.result()
+                    engine.split_count += split_count
+                    engine.failed_splits += failed_splits
+                    engine.add_depth(depth)
+                    partitions.extend(subtree_partitions)
+                    if budget is not None:
+                        budget.stopped = budget.stopped or stopped
+                        budget.add(result.rows)
+                    if tree is not None:
+                        tree.graft(result.node, subtree)
+                else:
+                    partitions.append(result)
+    finally:
+        for a in shared:
+            a.release()
+    return partitions
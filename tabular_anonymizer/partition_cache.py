@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import List
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from .partition_labels import PartitionLabels
+
+"""
+On-disk cache of Mondrian partitions. Entries are keyed by a fingerprint of the feature and sensitive columns and
+of the partitioning parameters. Partitions are stored compactly as one partition id per row, so a cached run only
+needs to build the anonymized dataframe again. Least recently used entries are evicted when the cache grows over
+max_bytes.
+"""
+
+
+class PartitionCache:
+    directory: str = None
+    max_bytes: int = 1 << 30    # Total size of cached entries, least recently used entries are evicted over this
+    SUFFIX = ".npy"
+
+    def __init__(self, directory: str, max_bytes: int = 1 << 30) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def fingerprint(df: DataFrame, columns: List[str], **parameters) -> str:
+        # Content hash of the columns in row order, column names and dtypes, and the parameters
+        digest = hashlib.sha256()
+        for column in columns:
+            series = df[column]
+            digest.update(json.dumps([str(column), str(series.dtype)]).encode())
+            digest.update(pd.util.hash_pandas_object(series, index=False).to_numpy().tobytes())
+        digest.update(json.dumps(parameters, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key: str) -> List[np.ndarray]:
+        # Cached partitions as arrays of row positions, in the original order, or None
+        labels = self.get_labels(key)
+        return None if labels is None else list(labels)
+
+    def get_labels(self, key: str) -> PartitionLabels:
+        # Cached partitions, rows in ascending order within partitions, or None
+        path = self.__path(key)
+        try:
+            labels = np.load(path)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        # Mark as recently used
+        os.utime(path)
+        return PartitionLabels.from_labels(labels)
+
+    def put(self, key: str, partitions: List[np.ndarray], n_rows: int) -> None:
+        # partitions may also be PartitionLabels
+        if isinstance(partitions, PartitionLabels):
+            labels = partitions.labels
+        else:
+            labels = PartitionLabels.from_positions(partitions, n_rows).labels
+        # Written to a temporary file first, so readers never see a partial entry
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, labels)
+        os.replace(temporary, self.__path(key))
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.SUFFIX):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.__remove(os.path.join(self.directory, name))
+            total -= size
+
+    def invalidate(self, key: str = None) -> None:
+        # Remove one entry, or all entries if key is not given
+        if key is not None:
+            self.__remove(self.__path(key))
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(self.SUFFIX):
+                self.__remove(os.path.join(self.directory, name))
+
+    @staticmethod
+    def __remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
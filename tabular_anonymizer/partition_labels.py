@@ -0,0 +1,89 @@
+from typing import Iterator, List, Tuple
+
+import numpy as np
+from pandas import Index
+
+"""
+Compact representation of partitions. Every row of the input has the id of its partition, or -1 if it is in no
+partition (missing value in a numeric split column). Rows are also grouped by partition in CSR layout: row positions
+of partition i are rows[offsets[i]:offsets[i + 1]]. Both are single integer arrays, so partitions are cheap to
+store, cache and send to other processes, and the anonymized dataframe is built from them without index lookups.
+"""
+
+
+class PartitionLabels:
+    labels: np.ndarray = None   # Partition id of every row, -1 for rows in no partition
+    rows: np.ndarray = None     # Row positions grouped by partition
+    offsets: np.ndarray = None  # Start of every partition in rows, followed by len(rows)
+    index: Index = None         # Index of the partitioned dataframe, row positions are converted to these labels
+
+    def __init__(self, labels: np.ndarray, rows: np.ndarray, offsets: np.ndarray, index: Index = None) -> None:
+        self.labels = labels
+        self.rows = rows
+        self.offsets = offsets
+        self.index = index
+
+    @staticmethod
+    def dtype(n: int) -> type:
+        # Smallest of int32 and int64 that holds ids or positions below n, and -1
+        return np.int32 if n < np.iinfo(np.int32).max else np.int64
+
+    @classmethod
+    def from_positions(cls, positions: List[np.ndarray], n_rows: int, index: Index = None):
+        # Partitions as arrays of row positions, order of rows within partitions is kept
+        sizes = np.fromiter((len(p) for p in positions), dtype=np.int64, count=len(positions))
+        rows = np.concatenate(positions) if positions else np.empty(0, np.int64)
+        rows = rows.astype(cls.dtype(n_rows), copy=False)
+        labels = np.full(n_rows, -1, dtype=cls.dtype(len(positions)))
+        labels[rows] = np.repeat(np.arange(len(positions), dtype=labels.dtype), sizes)
+        return cls(labels, rows, np.concatenate(([0], np.cumsum(sizes))), index)
+
+    @classmethod
+    def from_labels(cls, labels: np.ndarray, index: Index = None):
+        # Rows are in ascending order within partitions
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels[labels >= 0])
+        # Rows in no partition have id -1 and sort first
+        rows = order[len(labels) - int(counts.sum()):].astype(cls.dtype(len(labels)))
+        return cls(labels, rows, np.concatenate(([0], np.cumsum(counts))), index)
+
+    @classmethod
+    def from_partitions(cls, partitions: list, index: Index):
+        # Partitions as index labels of a dataframe with a unique index
+        if not index.is_unique:
+            raise Exception("Partition labels require a unique index")
+        return cls.from_positions([index.get_indexer(p) for p in partitions], len(index), index)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        return self.rows[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def sizes(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def batches(self, max_rows: int) -> Iterator[Tuple[np.ndarray, "PartitionLabels"]]:
+        # Consecutive partitions with at most max_rows rows together, at least one partition per batch. Yields row
+        # positions of the batch and labels of the partitions relative to these rows.
+        start = 0
+        while start < len(self):
+            stop = int(np.searchsorted(self.offsets, self.offsets[start] + max_rows, side="right")) - 1
+            stop = min(max(stop, start + 1), len(self))
+            offsets = self.offsets[start:stop + 1] - self.offsets[start]
+            rows = self.rows[self.offsets[start]:self.offsets[stop]]
+            labels = np.repeat(np.arange(stop - start, dtype=self.dtype(stop - start)), np.diff(offsets))
+            local = np.arange(len(rows), dtype=self.dtype(len(rows)))
+            yield rows, PartitionLabels(labels, local, offsets)
+            start = stop
+
+    def partitions(self, index: Index = None) -> List[Index]:
+        # Partitions as index labels, the form returned by partition() by default
+        index = self.index if index is None else index
+        if index is None:
+            return list(self)
+        return [index[p] for p in self]
@@ -0,0 +1,183 @@
+from collections import deque
+from typing import List
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Index
+
+"""
+Split history of a Mondrian run. Every node records its size and, for internal nodes, the split column
+and the split value (median for numeric columns, categories going left for categorical columns).
+Leaves record their row positions. Cutting the tree gives valid partitions for any larger k, or another l,
+without partitioning the data again.
+"""
+
+
+class PartitionTree:
+    index: Index = None     # Index of the partitioned dataframe, row positions are converted to these labels
+    k: int = 0              # Parameters the tree was built with
+    l: int = 0
+    t: float = None
+    sensitive_codes: List[np.ndarray] = []  # Factorized sensitive columns, used for l-diversity of nodes
+    sizes: List[int] = []   # Number of rows of each node
+    columns: List[str] = []     # Split column of each internal node, None for leaves
+    values: list = []       # Split value: median, or list of categories going to the left child
+    left: List[int] = []    # Child nodes, -1 for leaves
+    right: List[int] = []
+    rows: dict = {}         # Row positions of leaves
+    dropped: dict = {}      # Rows of internal nodes that went to neither child (missing values in split column)
+    closeness = None        # Function giving t-closeness distance of rows
+
+    # closeness(rows) gives the t-closeness distance of rows, see NumpyMondrianEngine.closeness()
+    def __init__(self, index: Index = None, sensitive_codes: List[np.ndarray] = None, k: int = 0, l: int = 0,
+                 t: float = None, closeness=None) -> None:
+        self.index = index
+        self.sensitive_codes = sensitive_codes or []
+        self.k = k
+        self.l = l
+        self.t = t
+        self.closeness = closeness
+        self.sizes = []
+        self.columns = []
+        self.values = []
+        self.left = []
+        self.right = []
+        self.rows = {}
+        self.dropped = {}
+        self._diversity = {}
+        self._closeness = {}
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    def add_node(self, size: int) -> int:
+        self.sizes.append(size)
+        self.columns.append(None)
+        self.values.append(None)
+        self.left.append(-1)
+        self.right.append(-1)
+        return len(self.sizes) - 1
+
+    def add_split(self, node: int, column: str, value, left_size: int, right_size: int,
+                  dropped: np.ndarray = None) -> (int, int):
+        self.columns[node] = column
+        self.values[node] = value
+        self.left[node] = self.add_node(left_size)
+        self.right[node] = self.add_node(right_size)
+        if dropped is not None and len(dropped):
+            self.dropped[node] = dropped
+        return self.left[node], self.right[node]
+
+    def add_leaf(self, node: int, rows: np.ndarray) -> None:
+        self.rows[node] = rows
+
+    def graft(self, node: int, subtree: "PartitionTree") -> dict:
+        # Replace node with the root of a subtree built separately, e.g. in a worker process.
+        # Returns node ids of the subtree nodes in this tree.
+        ids = {0: node}
+        for n in range(1, len(subtree)):
+            ids[n] = self.add_node(subtree.sizes[n])
+        for n in range(len(subtree)):
+            m = ids[n]
+            self.columns[m] = subtree.columns[n]
+            self.values[m] = subtree.values[n]
+            if subtree.left[n] >= 0:
+                self.left[m] = ids[subtree.left[n]]
+                self.right[m] = ids[subtree.right[n]]
+            if n in subtree.rows:
+                self.rows[m] = subtree.rows[n]
+            if n in subtree.dropped:
+                self.dropped[m] = subtree.dropped[n]
+        return ids
+
+    def is_leaf(self, node: int) -> bool:
+        return self.left[node] < 0
+
+    def node_rows(self, node: int) -> np.ndarray:
+        # Row positions of all rows under node, in original row order
+        if self.is_leaf(node):
+            return self.rows[node]
+        parts = []
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            if self.is_leaf(n):
+                parts.append(self.rows[n])
+            else:
+                if n in self.dropped:
+                    parts.append(self.dropped[n])
+                stack.extend((self.right[n], self.left[n]))
+        return np.sort(np.concatenate(parts))
+
+    def diversity(self, node: int) -> int:
+        # Smallest number of distinct values of a sensitive column under node
+        if node not in self._diversity:
+            rows = self.node_rows(node)
+            self._diversity[node] = min((len(np.unique(codes[rows])) for codes in self.sensitive_codes), default=0)
+        return self._diversity[node]
+
+    def distance(self, node: int) -> float:
+        # Largest t-closeness distance of a sensitive column under node
+        if node not in self._closeness:
+            self._closeness[node] = self.closeness(self.node_rows(node))
+        return self._closeness[node]
+
+    def is_valid(self, node: int, k: int, l: int = 0, t: float = None) -> bool:
+        if self.sizes[node] < k:
+            return False
+        if l > 0 and self.sensitive_codes and self.diversity(node) < l:
+            return False
+        if t is not None and self.closeness is not None and self.distance(node) > t:
+            return False
+        return True
+
+    def route(self, df: DataFrame, node: int = 0) -> np.ndarray:
+        # Leaf node of every row of df, following the recorded splits down from node. Rows with missing value
+        # in a numeric split column go to the right child, categories not seen in the split go to the right child.
+        # Missing categorical values follow the missing category of the split, as the engine splits them.
+        nodes = np.full(len(df), node, dtype=np.int64)
+        if len(self) == 0:
+            return nodes
+        stack = [(node, np.arange(len(df)))]
+        while stack:
+            n, rows = stack.pop()
+            if self.is_leaf(n) or len(rows) == 0:
+                nodes[rows] = n
+                continue
+            values = df[self.columns[n]].iloc[rows]
+            split = self.values[n]
+            if isinstance(split, list):
+                # Missing values (None or nan) went left if a missing value is among the categories
+                categories = [c for c in split if not pd.isna(c)]
+                left = values.isin(categories).to_numpy()
+                if len(categories) < len(split):
+                    left |= values.isna().to_numpy()
+            else:
+                left = (values < split).to_numpy(dtype=bool, na_value=False)
+            stack.append((self.right[n], rows[~left]))
+            stack.append((self.left[n], rows[left]))
+        return nodes
+
+    def cut(self, k: int = None, l: int = None, t: float = None) -> List[np.ndarray]:
+        # Keep a recorded split only if both children are valid with the given parameters. Partitions are
+        # returned in the same breadth-first order as MondrianAnonymizer.partition().
+        # The tree cannot be refined, so a smaller k or l (or larger t) than the tree was built with
+        # gives the original leaves.
+        k = self.k if k is None else k
+        l = self.l if l is None else l
+        t = self.t if t is None else t
+        if len(self) == 0:
+            return []
+        partitions = []
+        queue = deque([0])
+        while queue:
+            node = queue.popleft()
+            left, right = self.left[node], self.right[node]
+            if left >= 0 and self.is_valid(left, k, l, t) and self.is_valid(right, k, l, t):
+                queue.extend((left, right))
+            else:
+                partitions.append(self.node_rows(node))
+        return partitions
+
+    def partitions(self, k: int = None, l: int = None, t: float = None) -> List[Index]:
+        return [self.index[p] for p in self.cut(k, l, t)]
@@ -0,0 +1,87 @@
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+from .partition_labels import PartitionLabels
+
+"""
+Instrumentation of anonymization runs. Top-level phases (reading, preparing, partitioning, aggregating, building
+the output) record wall time and, with memory=True, peak memory traced with tracemalloc. The partitioning loop of
+the numpy engine also accumulates time spent on spans, splitting, validity checks and child bounds.
+"""
+
+
+class AnonymizationStats:
+    seconds: dict = {}      # Wall time of each phase
+    peak_memory: dict = {}  # Peak traced memory of each top-level phase in bytes, with memory=True
+    split_count: int = 0    # Split attempts
+    failed_splits: int = 0  # Split attempts rejected because a child would not be valid
+    depth: int = None       # Depth of the deepest partition, numpy engine
+    leaf_sizes: np.ndarray = None   # Number of rows of each partition
+    memory: bool = False    # Trace peak memory of top-level phases, slows the run down considerably
+    callback = None         # Called with (phase name, stats) after every top-level phase
+
+    def __init__(self, memory: bool = False, callback=None) -> None:
+        self.memory = memory
+        self.callback = callback
+        self.seconds = {}
+        self.peak_memory = {}
+        self.split_count = 0
+        self.failed_splits = 0
+        self.depth = None
+        self.leaf_sizes = None
+
+    @property
+    def accepted_splits(self) -> int:
+        return self.split_count - self.failed_splits
+
+    @contextmanager
+    def phase(self, name: str):
+        started = False
+        if self.memory:
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.start()
+                started = True
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+            if self.memory:
+                self.peak_memory[name] = max(self.peak_memory.get(name, 0), tracemalloc.get_traced_memory()[1])
+                if started:
+                    tracemalloc.stop()
+        if self.callback is not None:
+            self.callback(name, self)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def add_partitions(self, partitions) -> None:
+        if isinstance(partitions, PartitionLabels):
+            self.leaf_sizes = partitions.sizes()
+        else:
+            self.leaf_sizes = np.array([len(p) for p in partitions], dtype=np.int64)
+
+    def leaf_summary(self) -> dict:
+        # Distribution of partition sizes
+        sizes = self.leaf_sizes
+        if sizes is None or len(sizes) == 0:
+            return {"count": 0}
+        return {"count": len(sizes), "min": int(sizes.min()), "max": int(sizes.max()), "mean": float(sizes.mean()),
+                "median": float(np.median(sizes)), "p90": float(np.percentile(sizes, 90)),
+                "p99": float(np.percentile(sizes, 99))}
+
+    def to_dict(self) -> dict:
+        return {"seconds": dict(self.seconds), "peak_memory": dict(self.peak_memory),
+                "split_count": self.split_count, "failed_splits": self.failed_splits,
+                "accepted_splits": self.accepted_splits, "depth": self.depth, "leaf_sizes": self.leaf_summary()}
+
+
+def phase(stats: AnonymizationStats, name: str):
+    # Context manager timing a phase, does nothing without stats
+    return nullcontext() if stats is None else stats.phase(name)